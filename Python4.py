@@ -1,110 +1,366 @@
-
+# -*- coding: cp1251 -*-
+#      :       .
+# ,       (csv, json, re, passwords, sessions),
+#   ,    
+import itertools
 import sqlite3
 
+from database import ConnectionPool, begin_immediate
+from migrations import SHOP_MIGRATIONS, USER_MIGRATIONS, ensure_schema, migrate
+from permissions import (ORDER_CREATE, ORDER_DELETE, ORDER_VIEW, ORDER_VIEW_SELF, PRODUCT_ADD, PRODUCT_DELETE,
+                         PRODUCT_UPDATE, PRODUCT_VIEW, USER_CREATE, USER_DELETE, USER_UPDATE, USER_UPDATE_SELF,
+                         USER_VIEW, PermissionDenied, require, requires)
+from product_cache import ProductCache
+from reporting import SalesReport, record_sales
+from reservations import StockReservations, release_holds
+
+#        "... IN (?, ?, ...)"
+SQLITE_MAX_PARAMS = 500
+
+#   ( )    
+IMPORT_CHUNK_SIZE = 5000
+
+# ,   filter_products  ,      (id, name, price, quantity)
+PRODUCT_SORT_COLUMNS = {"name": 1, "price": 2, "quantity": 3}
+
+#   filter_products  
+FILTER_PAGE_SIZE = 100
+
+#          iter_*
+FETCH_BATCH_SIZE = 1000
+
+#  ,     iter_*   columns
+PRODUCT_COLUMNS = ("id", "name", "price", "quantity")
+SEARCH_RESULTS_LIMIT = 20
+#          (bm25)
+SEARCH_NAME_WEIGHT = 10.0
+ORDER_COLUMNS = ("id", "customer_name", "total_price")
+USER_COLUMNS = ("id", "username", "password", "role")
+
+#   ,  JewelryShop.create_order / create_orders
+ORDER_LINE_ACCEPTED = "accepted"
+ORDER_LINE_NOT_FOUND = "not_found"
+ORDER_LINE_OUT_OF_STOCK = "out_of_stock"
+ORDER_LINE_INVALID_QUANTITY = "invalid_quantity"
+
+class CartLine:
+    # __slots__:       
+    __slots__ = ("product_id", "price", "quantity")
+
+    def __init__(self, product_id: int, price: float, quantity: int = 0):
+        """
+         : id ,      .
+        """
+        self.product_id = product_id
+        self.price = price
+        self.quantity = quantity
+
+
 class Cart:
-    def __init__(self):
+    __slots__ = ("shop", "items", "total")
+
+    def __init__(self, shop: "JewelryShop"):
         """
           Cart.
+        shop: ,      id    .
         """
+        self.shop = shop
         self.items = {}
+        self.total = 0.0
 
     def add_item(self, product_name: str, quantity: int):
         """
            .
+            ( )    ;  .
         """
-        if product_name in self.items:
-            self.items[product_name] += quantity
-        else:
-            self.items[product_name] = quantity
+        if quantity <= 0:
+            raise ValueError(f"   ,  {quantity}.")
+        line = self.items.get(product_name)
+        if line is None:
+            product = self.shop.get_product(product_name)
+            if product is None:
+                raise ValueError(f"   '{product_name}'  .")
+            product_id, price, _ = product
+            line = self.items[product_name] = CartLine(product_id, price)
+        line.quantity += quantity
+        self.total += line.price * quantity
+
+    def update_item(self, product_name: str, quantity: int):
+        """
+            ; 0  .
+        """
+        if quantity < 0:
+            raise ValueError(f"    ,  {quantity}.")
+        line = self.items.get(product_name)
+        if line is None:
+            if quantity:
+                self.add_item(product_name, quantity)
+            return
+        if quantity == 0:
+            self.remove_item(product_name)
+            return
+        self.total += line.price * (quantity - line.quantity)
+        line.quantity = quantity
+
+    def remove_item(self, product_name: str):
+        """
+           .
+        """
+        line = self.items.pop(product_name, None)
+        if line is not None:
+            self.total -= line.price * line.quantity
+
+    def restore_line(self, product_name: str, product_id: int, price: float, quantity: int):
+        """
+            (,   )    .
+        """
+        self.remove_item(product_name)
+        self.items[product_name] = CartLine(product_id, price, quantity)
+        self.total += price * quantity
 
     def clear_cart(self):
         """
          .
         """
         self.items = {}
+        self.total = 0.0
 
     def get_cart(self) -> dict:
         """
            .
         return:     { : }.
         """
-        return self.items
-    
+        return {product_name: line.quantity for product_name, line in self.items.items()}
+
+    def order_lines(self) -> list:
+        """
+          JewelryShop.create_order:  (, id , ).
+        """
+        return [(product_name, line.product_id, line.quantity) for product_name, line in self.items.items()]
+
+    def validate_stock(self) -> dict:
+        """
+              .
+        return:  { : },  -    ORDER_LINE_*.
+        """
+        stock = self.shop.get_stock([line.product_id for line in self.items.values()])
+        statuses = {}
+        for product_name, line in self.items.items():
+            product = stock.get(line.product_id)
+            if product is None:
+                statuses[product_name] = ORDER_LINE_NOT_FOUND
+            elif product[1] < line.quantity:
+                statuses[product_name] = ORDER_LINE_OUT_OF_STOCK
+            else:
+                statuses[product_name] = ORDER_LINE_ACCEPTED
+        return statuses
+
+
+def _select_in(cursor: sqlite3.Cursor, query: str, values: list) -> list:
+    """
+        "IN ({placeholders})"   SQLITE_MAX_PARAMS .
+    return:   .
+    """
+    rows = []
+    for start in range(0, len(values), SQLITE_MAX_PARAMS):
+        chunk = values[start:start + SQLITE_MAX_PARAMS]
+        cursor.execute(query.format(placeholders=", ".join("?" * len(chunk))), chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def _order_lines(products) -> list:
+    """
+      (Cart   {: })   (, id  None, ).
+    """
+    if isinstance(products, Cart):
+        return products.order_lines()
+    return [(product_name, None, quantity) for product_name, quantity in products.items()]
+
+
+def _product_row(product) -> tuple:
+    """
+       (  )   (, , ).
+    """
+    if isinstance(product, dict):
+        return product["name"], float(product["price"]), int(product["quantity"])
+    name, price, quantity = product
+    return name, float(price), int(quantity)
+
+
+def _column_list(columns, allowed: tuple) -> str:
+    """
+           SELECT; None -   .
+    """
+    columns = allowed if columns is None else tuple(columns)
+    unknown = [column for column in columns if column not in allowed]
+    if unknown or not columns:
+        raise ValueError(f" : {unknown or columns}")
+    return ", ".join(columns)
+
+
+def iter_rows(cursor: sqlite3.Cursor, batch_size: int = FETCH_BATCH_SIZE):
+    """
+      ,      batch_size  fetchmany.
+    """
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def product_page_key(product: tuple, order_by: str = "price") -> tuple:
+    """
+      (id, name, price, quantity)   after  JewelryShop.filter_products.
+    """
+    return product[PRODUCT_SORT_COLUMNS[order_by]], product[0]
+
+
 class JewelryShop:
-    def __init__(self, database_path: str = "jewelry_shop.db"):
-        self.conn = sqlite3.connect(database_path)
-        self.cursor = self.conn.cursor()
-        self.create_tables()
+    def __init__(self, database_path: str = "jewelry_shop.db", pool: ConnectionPool = None,
+                 product_cache: ProductCache = None, audit: "AuditLog" = None, authorizer: "Authorizer" = None):
+        #       ,      
+        self.pool = pool if pool is not None else ConnectionPool(database_path)
+        #   (. audit.AuditLog):      actor
+        self.audit = audit
+        #  ,   @requires     (. permissions)
+        self.authorizer = authorizer
+        #  :   ,   products
+        self.product_cache = product_cache if product_cache is not None else ProductCache()
+        #       conn,    
+        self._schema_ready = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = self.pool.get()
+        if not self._schema_ready:
+            #   PRAGMA user_version ( -    )
+            ensure_schema(conn, SHOP_MIGRATIONS)
+            self._schema_ready = True
+        return conn
+
+    def get_query_stats(self) -> dict:
+        """
+             (. instrumentation.QueryStats.dump).
+        """
+        return self.pool.stats.dump()
+
+    def reset_query_stats(self):
+        self.pool.stats.reset()
 
     def create_tables(self):
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL UNIQUE,  --  UNIQUE constraint
-                price REAL NOT NULL,
-                quantity INTEGER NOT NULL
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                customer_name TEXT NOT NULL,
-                total_price REAL NOT NULL
-            )
-        ''')
-
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS order_items (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                order_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER NOT NULL,
-                FOREIGN KEY (order_id) REFERENCES orders(id),
-                FOREIGN KEY (product_id) REFERENCES products(id)
-            )
-        ''')
-
-        self.conn.commit()
-
-
-    def add_product(self, name: str, price: float, quantity: int):
+        #    ;    -   PRAGMA user_version
+        migrate(self.pool.get(), SHOP_MIGRATIONS)
+        self._schema_ready = True
+
+    def _audit(self, action: str, entity_id, actor: str, **details):
+        if self.audit is not None:
+            self.audit.record(action, "product", entity_id, actor, **details)
+
+    @requires(PRODUCT_ADD)
+    def add_product(self, name: str, price: float, quantity: int, description: str = "", actor: str = None):
+        cursor = self.conn.cursor()
         # ,          
-        self.cursor.execute("SELECT * FROM products WHERE name=?", (name,))
-        existing_product = self.cursor.fetchone()
+        cursor.execute("SELECT * FROM products WHERE name=?", (name,))
+        existing_product = cursor.fetchone()
 
         if existing_product:
             #       ,  
             updated_quantity = existing_product[3] + quantity
-            self.cursor.execute("UPDATE products SET quantity=? WHERE name=?", (updated_quantity, name))
+            cursor.execute("UPDATE products SET quantity=? WHERE name=?", (updated_quantity, name))
             self.conn.commit()
+            self.product_cache.invalidate((name,))
+            self._audit("restock", name, actor, added=quantity, quantity=updated_quantity)
             print(f"  '{name}'  .")
         else:
             #      ,  
-            self.cursor.execute("INSERT INTO products (name, price, quantity) VALUES (?, ?, ?)", (name, price, quantity))
+            cursor.execute("INSERT INTO products (name, price, quantity, description) VALUES (?, ?, ?, ?)",
+                           (name, price, quantity, description))
             self.conn.commit()
+            self.product_cache.invalidate((name,))
+            self._audit("add", name, actor, price=price, quantity=quantity)
             print(f" '{name}'  .")
 
-    def delete_product(self, product_name: str):
+    @requires(PRODUCT_ADD)
+    def bulk_upsert_products(self, products, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+        """
+         / .
+        products:    (, , )  
+          name, price, quantity;  ,   chunk_size .
+            ,      (  add_product).
+        return:  {"inserted":   , "updated":   }.
+        """
+        summary = {"inserted": 0, "updated": 0}
+        cursor = self.conn.cursor()
+        rows = (_product_row(product) for product in products)
+        while True:
+            chunk = list(itertools.islice(rows, chunk_size))
+            if not chunk:
+                break
+
+            # ,        
+            names = list({row[0] for row in chunk})
+            existing = {name for name, in _select_in(cursor, "SELECT name FROM products WHERE name IN ({placeholders})",
+                                                     names)}
+            for name, _, _ in chunk:
+                if name in existing:
+                    summary["updated"] += 1
+                else:
+                    summary["inserted"] += 1
+                    existing.add(name)
+
+            cursor.executemany('''
+                INSERT INTO products (name, price, quantity) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET price = excluded.price, quantity = quantity + excluded.quantity
+            ''', chunk)
+            self.conn.commit()
+            self.product_cache.invalidate(names)
+        return summary
+
+    def import_products_csv(self, path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+        """
+            CSV-   name,price,quantity.
+        return:  bulk_upsert_products.
+        """
+        import csv
+        with open(path, newline="", encoding="utf-8") as file:
+            return self.bulk_upsert_products(csv.DictReader(file), chunk_size)
+
+    def import_products_jsonl(self, path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+        """
+            JSONL- (   {"name", "price", "quantity"}  ).
+        return:  bulk_upsert_products.
+        """
+        import json
+        with open(path, encoding="utf-8") as file:
+            return self.bulk_upsert_products((json.loads(line) for line in file if line.strip()), chunk_size)
+
+    @requires(PRODUCT_DELETE)
+    def delete_product(self, product_name: str, actor: str = None):
+        cursor = self.conn.cursor()
         # ,      
-        self.cursor.execute("SELECT * FROM products WHERE name=?", (product_name,))
-        existing_product = self.cursor.fetchone()
+        cursor.execute("SELECT * FROM products WHERE name=?", (product_name,))
+        existing_product = cursor.fetchone()
 
         if existing_product:
             #     products
-            self.cursor.execute("DELETE FROM products WHERE name=?", (product_name,))
-
-            #      order_items
-            self.cursor.execute("DELETE FROM order_items WHERE product_id=?", (existing_product[0],))
+            cursor.execute("DELETE FROM products WHERE name=?", (product_name,))
+            #       ,     
 
             self.conn.commit()
+            self.product_cache.invalidate((product_name,))
+            self._audit("delete", product_name, actor, price=existing_product[2], quantity=existing_product[3])
             print(f" '{product_name}'  .")
         else:
             print(f"   '{product_name}'  .")
-    def update_product(self, product_name: str, new_price: float = None, new_quantity: int = None):
+    @requires(PRODUCT_UPDATE)
+    def update_product(self, product_name: str, new_price: float = None, new_quantity: int = None,
+                       actor: str = None):
+        cursor = self.conn.cursor()
         # ,      
-        self.cursor.execute("SELECT * FROM products WHERE name=?", (product_name,))
-        existing_product = self.cursor.fetchone()
+        cursor.execute("SELECT * FROM products WHERE name=?", (product_name,))
+        existing_product = cursor.fetchone()
 
         if existing_product:
             current_price, current_quantity = existing_product[2], existing_product[3]
@@ -114,90 +370,345 @@ class JewelryShop:
             updated_quantity = new_quantity if new_quantity is not None else current_quantity
 
             #    
-            self.cursor.execute("UPDATE products SET price=?, quantity=? WHERE name=?",
-                                (updated_price, updated_quantity, product_name))
+            cursor.execute("UPDATE products SET price=?, quantity=? WHERE name=?",
+                           (updated_price, updated_quantity, product_name))
             self.conn.commit()
+            self.product_cache.invalidate((product_name,))
+            self._audit("update", product_name, actor, price=[current_price, updated_price],
+                        quantity=[current_quantity, updated_quantity])
 
             print(f"  '{product_name}'  .")
         else:
             print(f"   '{product_name}'  .")
-    def filter_products(self, min_price=None, max_price=None, min_quantity=None, max_quantity=None):
-        #  SQL-   
-        try:
-            query = "SELECT * FROM products "
-            params = []
-
-            if min_price is not None:
-                query += " AND price >= ?"
-                params.append(min_price)
-
-            if max_price is not None:
-                query += " AND price <= ?"
-                params.append(max_price)
-
-            if min_quantity is not None:
-                query += " AND quantity >= ?"
-                params.append(min_quantity)
-
-            if max_quantity is not None:
-                query += " AND quantity <= ?"
-                params.append(max_quantity)
+    @staticmethod
+    def _product_conditions(min_price=None, max_price=None, min_quantity=None, max_quantity=None) -> tuple:
+        #      
+        conditions = []
+        params = []
+
+        if min_price is not None:
+            conditions.append("price >= ?")
+            params.append(min_price)
+
+        if max_price is not None:
+            conditions.append("price <= ?")
+            params.append(max_price)
+
+        if min_quantity is not None:
+            conditions.append("quantity >= ?")
+            params.append(min_quantity)
+
+        if max_quantity is not None:
+            conditions.append("quantity <= ?")
+            params.append(max_quantity)
+
+        return conditions, params
+
+    @requires(PRODUCT_VIEW)
+    def filter_products(self, min_price=None, max_price=None, min_quantity=None, max_quantity=None,
+                        order_by: str = "price", descending: bool = False, limit: int = FILTER_PAGE_SIZE,
+                        after: tuple = None) -> list:
+        """
+                 (keyset pagination).
+        order_by:   - price, quantity  name.
+        after:      (. product_page_key); None -  .
+        return:   (id, name, price, quantity)    limit.
+        """
+        if order_by not in PRODUCT_SORT_COLUMNS:
+            raise ValueError(f"   '{order_by}'  .")
+
+        conditions, params = self._product_conditions(min_price, max_price, min_quantity, max_quantity)
+
+        #   ,    ,  OFFSET
+        if after is not None:
+            conditions.append(f"({order_by}, id) {'<' if descending else '>'} (?, ?)")
+            params.extend(after)
+
+        query = f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = "DESC" if descending else "ASC"
+        query += f" ORDER BY {order_by} {direction}, id {direction} LIMIT ?"
+        params.append(limit)
+
+        cursor = self.conn.cursor()
+        #  
+        cursor.execute(query, tuple(params))
+        return cursor.fetchall()
+
+    @requires(PRODUCT_VIEW)
+    def get_product(self, product_name: str):
+        """
+             .
+        return:  (id, price, quantity)  None,   .
+        """
+        product = self.product_cache.get(product_name)
+        if product is None:
+            generation = self.product_cache.generation
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id, price, quantity FROM products WHERE name=?", (product_name,))
+            product = cursor.fetchone()
+            if product is not None:
+                self.product_cache.put(product_name, product, generation)
+        return product
+
+    @requires(PRODUCT_VIEW)
+    def search_products(self, query: str, limit: int = SEARCH_RESULTS_LIMIT) -> list:
+        """
+               ( products_fts).
+               ("gold"  "Golden");   .
+        return:   (id, name, price, quantity),   .
+        """
+        import re
+        words = re.findall(r"\w+", query)
+        if not words:
+            return []
+        #    ,        FTS5
+        match = " ".join(f'"{word}"*' for word in words)
+        cursor = self.conn.cursor()
+        #   limit  rowid  ,      products
+        cursor.execute('''
+            SELECT products.id, products.name, products.price, products.quantity
+            FROM (SELECT rowid, bm25(products_fts, ?, 1.0) AS score FROM products_fts
+                  WHERE products_fts MATCH ? ORDER BY score LIMIT ?) AS found
+            JOIN products ON products.id = found.rowid
+            ORDER BY found.score
+        ''', (SEARCH_NAME_WEIGHT, match, limit))
+        return cursor.fetchall()
+
+    @requires(PRODUCT_VIEW)
+    def get_stock(self, product_ids) -> dict:
+        """
+                (  ).
+        return:  {id : (price, quantity)};     .
+        """
+        cursor = self.conn.cursor()
+        rows = _select_in(cursor, "SELECT id, price, quantity FROM products WHERE id IN ({placeholders})",
+                          list(set(product_ids)))
+        return {product_id: (price, quantity) for product_id, price, quantity in rows}
 
-            #  
-            self.cursor.execute(query, tuple(params))
-            return self.cursor.fetchall()
-        except Exception as e:
-            print('e')
-    
+    @requires(PRODUCT_VIEW)
     def get_available_products(self):
-        self.cursor.execute('SELECT * FROM products WHERE quantity > 0')
-        return self.cursor.fetchall()
+        return list(self.iter_available_products())
+    @requires(ORDER_VIEW)
     def get_orders(self):
-        self.cursor.execute('SELECT * FROM orders ')
-        return self.cursor.fetchall()
-    def create_order(self, customer_name: str, products: dict):
-        total_price = 0
-        for product_name, order_quantity in products.items():
-            self.cursor.execute("SELECT name, price, quantity FROM products WHERE name=?", (product_name,))
-            product_data = self.cursor.fetchone()
-
-            if product_data and product_data[2] >= order_quantity:
-                product_name, product_price, available_quantity = product_data
-                total_price += product_price * order_quantity
-
-                #      products
-                updated_quantity = available_quantity - order_quantity
-                self.cursor.execute("UPDATE products SET quantity=? WHERE name=?", (updated_quantity, product_name))
-
-        if total_price > 0:
-            #       orders
-            self.cursor.execute("INSERT INTO orders (customer_name, total_price) VALUES (?, ?)", (customer_name, total_price))
-            order_id = self.cursor.lastrowid
-
-            #       order_items
-            for product_name, order_quantity in products.items():
-                self.cursor.execute("SELECT id FROM products WHERE name=?", (product_name,))
-                product_id = self.cursor.fetchone()[0]
-
-                #         order_items
-                self.cursor.execute("INSERT INTO order_items (order_id, product_id, quantity) VALUES (?, ?, ?)",
-                                    (order_id, product_id, order_quantity))
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM orders ')
+        return cursor.fetchall()
+
+    def get_order_details(self, order_id: int):
+        """
+                order_items(order_id),    products.
+        return:  {"id", "customer_name", "total_price", "lines"},  lines -  
+        (product_id, product_name, unit_price, quantity)   ; None,   .
+          order.view_self ( order.view)     .
+        """
+        session = require(self, ORDER_VIEW, ORDER_VIEW_SELF)
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT orders.id, orders.customer_name, orders.total_price,
+                   order_items.product_id, order_items.product_name, order_items.unit_price, order_items.quantity
+            FROM orders LEFT JOIN order_items ON order_items.order_id = orders.id
+            WHERE orders.id = ?
+            ORDER BY order_items.id
+        ''', (order_id,))
+        rows = cursor.fetchall()
+        if not rows:
+            return None
+        order_id, customer_name, total_price = rows[0][:3]
+        if self.authorizer is not None and not session.can(ORDER_VIEW) and customer_name != session.username:
+            raise PermissionDenied(f" '{session.username}'     .")
+        return {"id": order_id, "customer_name": customer_name, "total_price": total_price,
+                "lines": [row[3:] for row in rows if row[3] is not None]}
+
+    @requires(PRODUCT_VIEW)
+    def iter_filter_products(self, min_price=None, max_price=None, min_quantity=None, max_quantity=None,
+                             order_by: str = "price", descending: bool = False, columns=None,
+                             batch_size: int = FETCH_BATCH_SIZE):
+        """
+          filter_products:      .
+        columns:     PRODUCT_COLUMNS; None -  .
+        """
+        if order_by not in PRODUCT_SORT_COLUMNS:
+            raise ValueError(f"   '{order_by}'  .")
+        conditions, params = self._product_conditions(min_price, max_price, min_quantity, max_quantity)
+        query = f"SELECT {_column_list(columns, PRODUCT_COLUMNS)} FROM products"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        direction = "DESC" if descending else "ASC"
+        query += f" ORDER BY {order_by} {direction}, id {direction}"
+        cursor = self.conn.cursor()
+        cursor.execute(query, tuple(params))
+        yield from iter_rows(cursor, batch_size)
+
+    @requires(PRODUCT_VIEW)
+    def iter_available_products(self, columns=None, batch_size: int = FETCH_BATCH_SIZE):
+        """
+          get_available_products.
+        columns:     PRODUCT_COLUMNS; None -  .
+        """
+        if columns is not None:
+            cursor = self.conn.cursor()
+            cursor.execute(f"SELECT {_column_list(columns, PRODUCT_COLUMNS)} FROM products WHERE quantity > 0")
+            yield from iter_rows(cursor, batch_size)
+            return
+
+        #     ;        
+        snapshot = self.product_cache.get_available()
+        if snapshot is not None:
+            yield from snapshot
+            return
+        generation = self.product_cache.generation
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {', '.join(PRODUCT_COLUMNS)} FROM products WHERE quantity > 0")
+        rows = []
+        for row in iter_rows(cursor, batch_size):
+            if rows is not None:
+                rows.append(row)
+                if len(rows) > self.product_cache.snapshot_limit:
+                    rows = None
+            yield row
+        if rows is not None:
+            self.product_cache.put_available(rows, generation)
+
+    @requires(ORDER_VIEW)
+    def iter_orders(self, columns=None, batch_size: int = FETCH_BATCH_SIZE):
+        """
+          get_orders.
+        columns:     ORDER_COLUMNS; None -  .
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {_column_list(columns, ORDER_COLUMNS)} FROM orders")
+        yield from iter_rows(cursor, batch_size)
+    def create_order(self, customer_name: str, products: dict, holder: str = None):
+        """
+          .
+        holder:   (. reservations),       .
+        return:  (id   None, { :  }).
+        """
+        return self.create_orders([(customer_name, products)], holders=(holder,) if holder is not None else ())[0]
 
+    @requires(ORDER_CREATE)
+    def create_orders(self, orders, holders=()) -> list:
+        """
+              .
+        orders:   ( , ),   - Cart   { : }.
+         Cart     id,     .
+        return:   (id   None, { :  }).
+          -    ORDER_LINE_*;  ,      .
+        holders:   ;        
+           ,     .
+        """
+        orders = [(customer_name, _order_lines(products)) for customer_name, products in orders]
+        names = list({product_name for _, lines in orders
+                      for product_name, product_id, _ in lines if product_id is None})
+        product_ids = list({product_id for _, lines in orders
+                            for _, product_id, _ in lines if product_id is not None})
+
+        # BEGIN IMMEDIATE     :     commit
+        cursor = begin_immediate(self.conn)
+        try:
+            released_names = release_holds(cursor, holders)
+
+            #   (  SQLITE_MAX_PARAMS )     
+            stock = {}
+            name_ids = {}
+            for product_id, name, price, quantity in _select_in(
+                    cursor, "SELECT id, name, price, quantity FROM products WHERE name IN ({placeholders})", names):
+                stock[product_id] = [price, quantity, name]
+                name_ids[name] = product_id
+            for product_id, name, price, quantity in _select_in(
+                    cursor, "SELECT id, name, price, quantity FROM products WHERE id IN ({placeholders})", product_ids):
+                stock[product_id] = [price, quantity, name]
+
+            results = []
+            decrements = {}
+            order_items = []
+            ordered_names = set()
+            #    (. reporting.record_sales)
+            product_sales = {}
+            customer_sales = {}
+            for customer_name, lines in orders:
+                line_results = {}
+                accepted_lines = []
+                total_price = 0
+                for product_name, product_id, order_quantity in lines:
+                    if product_id is None:
+                        product_id = name_ids.get(product_name)
+                    product = stock.get(product_id)
+                    if product is None:
+                        line_results[product_name] = ORDER_LINE_NOT_FOUND
+                    elif order_quantity <= 0:
+                        line_results[product_name] = ORDER_LINE_INVALID_QUANTITY
+                    elif product[1] < order_quantity:
+                        line_results[product_name] = ORDER_LINE_OUT_OF_STOCK
+                    else:
+                        product_price = product[0]
+                        product[1] -= order_quantity
+                        total_price += product_price * order_quantity
+                        decrements[product_id] = decrements.get(product_id, 0) + order_quantity
+                        units, revenue = product_sales.get(product_id, (0, 0))
+                        product_sales[product_id] = (units + order_quantity, revenue + product_price * order_quantity)
+                        accepted_lines.append((product_id, product[2], product_price, order_quantity))
+                        line_results[product_name] = ORDER_LINE_ACCEPTED
+                        ordered_names.add(product_name)
+
+                order_id = None
+                if accepted_lines:
+                    #       orders
+                    cursor.execute("INSERT INTO orders (customer_name, total_price) VALUES (?, ?)",
+                                   (customer_name, total_price))
+                    order_id = cursor.lastrowid
+                    orders_count, revenue = customer_sales.get(customer_name, (0, 0))
+                    customer_sales[customer_name] = (orders_count + 1, revenue + total_price)
+                    order_items.extend((order_id, *line) for line in accepted_lines)
+                results.append((order_id, line_results))
+
+            #        quantity >= 
+            cursor.executemany("UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+                               [(quantity, product_id, quantity) for product_id, quantity in decrements.items()])
+            if decrements and cursor.rowcount != len(decrements):
+                raise sqlite3.DatabaseError("      .")
+
+            #          
+            cursor.executemany("INSERT INTO order_items (order_id, product_id, product_name, unit_price, quantity) "
+                               "VALUES (?, ?, ?, ?, ?)", order_items)
+            record_sales(cursor, product_sales, customer_sales)
             self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        self.product_cache.invalidate(ordered_names.union(released_names))
+        return results
 
+    @requires(ORDER_DELETE)
     def delete_order(self, order_id: int):
-        # ,      
-        self.cursor.execute("SELECT * FROM orders WHERE id=?", (order_id,))
-        existing_order = self.cursor.fetchone()
+        #         
+        cursor = begin_immediate(self.conn)
+        try:
+            # ,      
+            cursor.execute("SELECT * FROM orders WHERE id=?", (order_id,))
+            existing_order = cursor.fetchone()
 
-        if existing_order:
-            #     orders
-            self.cursor.execute("DELETE FROM orders WHERE id=?", (order_id,))
+            if existing_order:
+                #   ,      
+                cursor.execute("SELECT product_id, SUM(quantity), SUM(quantity * unit_price) FROM order_items "
+                               "WHERE order_id = ? GROUP BY product_id", (order_id,))
+                product_sales = {product_id: (-units, -revenue) for product_id, units, revenue in cursor.fetchall()}
+                customer_sales = {existing_order[1]: (-1, -existing_order[2])}
+
+                #     orders
+                cursor.execute("DELETE FROM orders WHERE id=?", (order_id,))
 
-            #      order_items
-            self.cursor.execute("DELETE FROM order_items WHERE order_id=?", (order_id,))
+                #      order_items
+                cursor.execute("DELETE FROM order_items WHERE order_id=?", (order_id,))
 
+                record_sales(cursor, product_sales, customer_sales)
             self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        if existing_order:
             print(f"   {order_id}  .")
         else:
             print(f"   {order_id}  .")
@@ -205,7 +716,7 @@ class JewelryShop:
 
 # #  
 #
-jewelry_shop = JewelryShop()
+# jewelry_shop = JewelryShop()
 # #       
 # jewelry_shop.add_product("Gold Necklace", 500, 10)
 # jewelry_shop.add_product("Silver Earrings", 150, 20)
@@ -237,46 +748,87 @@ jewelry_shop = JewelryShop()
 
 
 class UserAuthentication:
-    def __init__(self, database_path: str = "users.db") -> None:
+    def __init__(self, database_path: str = "users.db", pool: ConnectionPool = None,
+                 hasher: "PasswordHasher" = None, audit: "AuditLog" = None,
+                 authorizer: "Authorizer" = None) -> None:
         """
           UserAuthentication.
 
         :param database_path:      SQLite.
+        :param pool:  ;     database_path.
+        :param hasher:  ;      .
+        :param audit:   (. audit.AuditLog)   .
+        :param authorizer:   (. permissions.Authorizer);     .
+        """
+        if hasher is None:
+            from passwords import PasswordHasher
+            hasher = PasswordHasher()
+        self.pool = pool if pool is not None else ConnectionPool(database_path)
+        self.hasher = hasher
+        self.audit = audit
+        self.authorizer = authorizer
+        #       conn,    
+        self._schema_ready = False
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """
+           ,    .
+              (  PRAGMA user_version).
+        """
+        conn = self.pool.get()
+        if not self._schema_ready:
+            ensure_schema(conn, USER_MIGRATIONS)
+            self._schema_ready = True
+        return conn
+
+    def get_query_stats(self) -> dict:
+        """
+            .
+
+        :return:  instrumentation.QueryStats.dump().
+        """
+        return self.pool.stats.dump()
+
+    def reset_query_stats(self) -> None:
         """
-        self.conn = sqlite3.connect(database_path)
-        self.cursor = self.conn.cursor()
-        self.create_table()
+             .
+        """
+        self.pool.stats.reset()
 
     def create_table(self) -> None:
         """
-          users   ,   .
+              (. migrations.USER_MIGRATIONS).
         """
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT NOT NULL,
-                password TEXT NOT NULL,
-                role TEXT NOT NULL
-            )
-        ''')
-        self.conn.commit()
+        migrate(self.pool.get(), USER_MIGRATIONS)
+        self._schema_ready = True
+
+    def _audit(self, action: str, entity_id, actor: str, **details) -> None:
+        if self.audit is not None:
+            self.audit.record(action, "user", entity_id, actor, **details)
 
     def register_user(self, username: str, password: str, role: str) -> None:
         """
           .
         role:   (client, employee, admin).
         """
-        # ,      
-        self.cursor.execute("SELECT * FROM users WHERE username=?", (username,))
-        existing_user = self.cursor.fetchone()
-
-        if existing_user:
-            print(f"   '{username}'  .   .")
-        else:
-            #   
-            self.cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)", (username, password, role))
+        cursor = self.conn.cursor()
+        #   ,      -    user.create.
+        #  -  ,      
+        if role != "client":
+            cursor.execute("SELECT 1 FROM users WHERE role='admin' LIMIT 1")
+            if role != "admin" or cursor.fetchone() is not None:
+                require(self, USER_CREATE)
+        try:
+            #   ;      .
+            #     idx_users_username,     
+            cursor.execute("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                           (username, self.hasher.hash(password), role))
             self.conn.commit()
             print("Registration successful!")
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            print(f"   '{username}'  .   .")
 
     def authenticate_user(self, username: str, password: str,role:str) -> bool:
         try:
@@ -284,52 +836,116 @@ class UserAuthentication:
               .
             return: True,    ,  False.
             """
-            self.cursor.execute("SELECT * FROM users WHERE username=? AND password=? AND role=?", (username, password,role))
-            user = self.cursor.fetchone()
-            return user is not None
+            cursor = self.conn.cursor()
+            cursor.execute("SELECT id, password FROM users WHERE username=? AND role=?", (username, role))
+            for user_id, stored_password in cursor.fetchall():
+                if self._check_password(user_id, username, password, stored_password):
+                    return True
+            return False
         except Exception as e:
             print(e)
 
+    def login(self, username: str, password: str):
+        """
+           :    .
+        return: permissions.Session  None,     .
+        """
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT id, password, role FROM users WHERE username=?", (username,))
+        user = cursor.fetchone()
+        if user is None or not self._check_password(user[0], username, password, user[1]):
+            return None
+        authorizer = self.authorizer
+        if authorizer is None:
+            from permissions import Authorizer
+            authorizer = Authorizer(self)
+        return authorizer.session(user[0], username, user[2])
+
+    def _check_password(self, user_id: int, username: str, password: str, stored_password: str) -> bool:
+        if not self.hasher.verify(username, password, stored_password):
+            return False
+        #            
+        if self.hasher.needs_rehash(stored_password):
+            self.conn.execute("UPDATE users SET password=? WHERE id=?", (self.hasher.hash(password), user_id))
+            self.conn.commit()
+        return True
+
+    @requires(USER_VIEW)
     def get_all_users(self) -> list:
         """
             .
 
         :return:      (id, username, password, role).
         """
-        self.cursor.execute("SELECT * FROM users")
-        return self.cursor.fetchall()
+        cursor = self.conn.cursor()
+        cursor.execute("SELECT * FROM users")
+        return cursor.fetchall()
+
+    @requires(USER_VIEW)
+    def iter_users(self, columns=None, batch_size: int = FETCH_BATCH_SIZE):
+        """
+          get_all_users:       batch_size.
 
-    def delete_user(self, user_id: int) -> None:
+        :param columns:     USER_COLUMNS; None -  .
+        :return:     .
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT {_column_list(columns, USER_COLUMNS)} FROM users")
+        yield from iter_rows(cursor, batch_size)
+
+    @requires(USER_DELETE)
+    def delete_user(self, user_id: int, actor: str = None) -> None:
         """
             .
 
         :param user_id:  .
+        :param actor:    (  ).
         """
         try:
-            self.cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
+            cursor = self.conn.cursor()
+            cursor.execute("DELETE FROM users WHERE id=?", (user_id,))
             self.conn.commit()
+            if cursor.rowcount:
+                if self.authorizer is not None:
+                    self.authorizer.invalidate()
+                self._audit("delete", user_id, actor)
         except Exception as e:
             print(e)
-    def update_user(self, user_id: int,new_name: str = None, new_password: str = None, new_role: str = None) -> None:
+    def update_user(self, user_id: int,new_name: str = None, new_password: str = None, new_role: str = None,
+                    actor: str = None) -> None:
         """
           .
+        actor:    (  );      .
+          user.update_self ( user.update)       ,   .
         """
+        session = require(self, USER_UPDATE, USER_UPDATE_SELF)
+        cursor = self.conn.cursor()
         # ,      
-        self.cursor.execute("SELECT * FROM users WHERE id=?", (user_id,))
-        existing_user = self.cursor.fetchone()
+        cursor.execute("SELECT * FROM users WHERE id=?", (user_id,))
+        existing_user = cursor.fetchone()
 
         if existing_user:
             current_name, current_password, current_role = existing_user[1], existing_user[2], existing_user[3]
 
             #      ,     
             updated_name = new_name if new_name is not None else current_name
-            updated_password = new_password if new_password is not None else current_password
+            updated_password = self.hasher.hash(new_password) if new_password is not None else current_password
             updated_role = new_role if new_role is not None else current_role
+            if self.authorizer is not None and not session.can(USER_UPDATE):
+                if existing_user[0] != session.user_id or updated_role != current_role:
+                    raise PermissionDenied(f" '{session.username}'       .")
 
             #    
-            self.cursor.execute("UPDATE users SET username=?,password=?, role=? WHERE id=?",
-                                (updated_name,updated_password, updated_role, user_id))
+            cursor.execute("UPDATE users SET username=?,password=?, role=? WHERE id=?",
+                           (updated_name,updated_password, updated_role, user_id))
             self.conn.commit()
+            if new_password is not None:
+                self.hasher.forget(current_name)
+            #       
+            if updated_role != current_role and self.authorizer is not None:
+                self.authorizer.invalidate()
+            self._audit("update", user_id, actor, username=[current_name, updated_name],
+                        role=[current_role, updated_role], password_changed=new_password is not None)
 
             print(f"    {user_id}  .")
         else:
@@ -338,9 +954,10 @@ class UserAuthentication:
         """
              .
         """
+        cursor = self.conn.cursor()
         # ,      
-        self.cursor.execute("SELECT id FROM users WHERE username=?", (username,))
-        user_id = self.cursor.fetchone()
+        cursor.execute("SELECT id FROM users WHERE username=?", (username,))
+        user_id = cursor.fetchone()
 
         if user_id:
             return user_id[0]
@@ -373,7 +990,31 @@ class UserAuthentication:
 # all_users_after_deletion = authenticator.get_all_users()
 # print("All Users After Deletion:", all_users_after_deletion)
 
-def main():
+def main(jewelry_shop: JewelryShop = None, user_auth: UserAuthentication = None):
+    """
+      .    (jewelry_shop.db, users.db)    .
+    """
+    from audit import AuditLog
+    from permissions import Authorizer
+    from sessions import SessionStore
+
+    #   (audit.db)       
+    audit = AuditLog()
+    if jewelry_shop is None:
+        jewelry_shop = JewelryShop(audit=audit)
+    if user_auth is None:
+        user_auth = UserAuthentication(audit=audit)
+    #      :       
+    (user_auth.authorizer or Authorizer(user_auth)).protect(jewelry_shop, user_auth)
+    session_store = SessionStore(jewelry_shop, cart_class=Cart, reservations=StockReservations(jewelry_shop))
+    try:
+        _menu(jewelry_shop, user_auth, session_store)
+    finally:
+        session_store.close()
+        audit.close()
+
+
+def _menu(jewelry_shop: JewelryShop, user_auth: UserAuthentication, session_store):
     while True:
         print("\n1. Register\n2. Login\n3. Exit")
         choice = input("Enter your choice: ")
@@ -383,152 +1024,257 @@ def main():
             username = input("Enter username: ")
             password = input("Enter password: ")
             role = input("Enter role (client, employee, admin): ")
-            user_auth.register_user(username, password, role)
+            try:
+                user_auth.register_user(username, password, role)
+            except PermissionDenied as e:
+                print(e)
 
 
         elif choice == "2":
             #  
             username = input("Enter username: ")
             password = input("Enter password: ")
-            role = input("Enter role (client, employee, admin): ")
-            if user_auth.authenticate_user(username, password,role):
+            #    ,    
+            session = user_auth.login(username, password)
+            if session is not None:
                 print("Authentication successful!")
+                role = session.role
+                session.activate()
                 if role == 'client':
-                    #   Cart   
-                    cart = Cart()
+                    #      (   )
+                    token = session_store.create_session(username, role)
 
                     while True:
-                        print("\n1. View Available Products\n2. Add Product to Cart\n3. View Cart\n4. Checkout\n5. Logout")
+                        #       (update_user):    
+                        if session.role != role:
+                            print("Your role has changed. Please log in again.")
+                            session_store.end_session(token)
+                            break
+                        print("\n1. View Available Products\n2. Add Product to Cart\n3. View Cart\n4. Checkout\n5. Search Products\n6. Logout")
                         user_choice = input("Enter your choice: ")
-
-                        if user_choice == "1":
-                            #   
-                            available_products = jewelry_shop.get_available_products()
-                            print("\nAvailable Products:")
-                            for product in available_products:
-                                print(product)
-
-                        elif user_choice == "2":
-                            #    
-                            product_name = input("Enter product name: ")
-                            quantity = int(input("Enter quantity: "))
-                            cart.add_item(product_name, quantity)
-                            print(f"{quantity} {product_name}(s) added to cart.")
-
-                        elif user_choice == "3":
-                            #  
-                            current_cart = cart.get_cart()
-                            print("\nCurrent Cart:")
-                            for item, quantity in current_cart.items():
-                                print(f"{item}: {quantity}")
-
-                        elif user_choice == "4":
-                            #  
-                            jewelry_shop.create_order(username, cart.get_cart())
-                            print("Order placed successfully!")
-
-                            #     
-                            cart.clear_cart()
-
-                        elif user_choice == "5":
-                            #    
+                        #       (     )
+                        if session_store.get_session(token) is None:
+                            print("Session expired. Please log in again.")
                             break
-                        else:
-                            print("Invalid choice. Please try again.")
+
+                        try:
+                            if user_choice == "1":
+                                #   
+                                print("\nAvailable Products:")
+                                for product in jewelry_shop.iter_available_products():
+                                    print(product)
+
+                            elif user_choice == "2":
+                                #    
+                                product_name = input("Enter product name: ")
+                                try:
+                                    quantity = int(input("Enter quantity: "))
+                                    session_store.add_item(username, product_name, quantity)
+                                    print(f"{quantity} {product_name}(s) added to cart.")
+                                except ValueError as e:
+                                    print(e)
+
+                            elif user_choice == "3":
+                                #  
+                                print("\nCurrent Cart:")
+                                cart = session_store.get_cart(username)
+                                for item, line in cart.items.items():
+                                    print(f"{item}: {line.quantity} x {line.price}")
+                                print(f"Total: {cart.total:.2f}")
+
+                            elif user_choice == "4":
+                                #  
+                                #     
+                                order_id, line_results = session_store.checkout(username)
+                                for item, status in line_results.items():
+                                    if status != ORDER_LINE_ACCEPTED:
+                                        print(f"{item}: not ordered ({status}).")
+                                if order_id is not None:
+                                    print(f"Order {order_id} placed successfully!")
+                                    #      
+                                    for _, item, unit_price, quantity in jewelry_shop.get_order_details(order_id)["lines"]:
+                                        print(f"{item}: {quantity} x {unit_price}")
+                                else:
+                                    print("Order was not placed.")
+
+                            elif user_choice == "5":
+                                #       
+                                search_query = input("Enter search text: ")
+                                for product in jewelry_shop.search_products(search_query):
+                                    print(product)
+
+                            elif user_choice == "6":
+                                #    
+                                session_store.end_session(token)
+                                break
+                            else:
+                                print("Invalid choice. Please try again.")
+                        except PermissionDenied as e:
+                            #      
+                            print(e)
                 elif role == "employee":
                     while True:
+                        #       (update_user):    
+                        if session.role != role:
+                            print("Your role has changed. Please log in again.")
+                            break
                         #    
                         print("\nEmployee Actions:")
                         print("1. Add Product\n2. Delete Product\n3. Update Product\n4. View Available Products\n5. Configure own user's data\n6. Logout")
 
                         employee_choice = input("Enter your choice: ")
 
-                        if employee_choice == "1":
-                            #   
-                            new_product_name = input("Enter product name: ")
-                            new_product_price = float(input("Enter product price: "))
-                            new_product_quantity = int(input("Enter product quantity: "))
-                            jewelry_shop.add_product(new_product_name, new_product_price, new_product_quantity)
-
-                        elif employee_choice == "2":
-                            #  
-                            product_to_delete = input("Enter product name to delete: ")
-                            jewelry_shop.delete_product(product_to_delete)
-
-                        elif employee_choice == "3":
-                            #   
-                            product_to_update = input("Enter product name to update: ")
-                            new_price = float(input("Enter new price (press Enter to keep current price): "))
-                            new_quantity = int(input("Enter new quantity (press Enter to keep current quantity): "))
-                            jewelry_shop.update_product(product_to_update, new_price, new_quantity)
-
-                        elif employee_choice == "4":
-                            #   
-                            available_products = jewelry_shop.get_available_products()
-                            print("\nAvailable Products:")
-                            for product in available_products:
-                                print(product)
-                        elif employee_choice == "5":
-                            #   
-                            username_from_login = username
-                            user_id_to_update = user_auth.get_id_by_name(username=username_from_login)
-                            new_name = input("Enter username  to update: ")
-                            new_password = input("Enter new password (press Enter to keep current password): ")
-                            new_role = input("Enter new role (press Enter to keep current role): ")
-                            user_auth.update_user(user_id_to_update,new_name, new_password, new_role)
-                            print(f"User with ID {user_id_to_update} updated successfully.")
-                        elif employee_choice == "6":
-                            #    
-                            break
-
-                        else:
-                            print("Invalid choice. Please try again.")            
+                        try:
+                            if employee_choice == "1":
+                                #   
+                                new_product_name = input("Enter product name: ")
+                                new_product_price = float(input("Enter product price: "))
+                                new_product_quantity = int(input("Enter product quantity: "))
+                                jewelry_shop.add_product(new_product_name, new_product_price, new_product_quantity,
+                                                         actor=username)
+
+                            elif employee_choice == "2":
+                                #  
+                                product_to_delete = input("Enter product name to delete: ")
+                                jewelry_shop.delete_product(product_to_delete, actor=username)
+
+                            elif employee_choice == "3":
+                                #   
+                                product_to_update = input("Enter product name to update: ")
+                                new_price = float(input("Enter new price (press Enter to keep current price): "))
+                                new_quantity = int(input("Enter new quantity (press Enter to keep current quantity): "))
+                                jewelry_shop.update_product(product_to_update, new_price, new_quantity, actor=username)
+
+                            elif employee_choice == "4":
+                                #   
+                                print("\nAvailable Products:")
+                                for product in jewelry_shop.iter_available_products():
+                                    print(product)
+                            elif employee_choice == "5":
+                                #   
+                                username_from_login = username
+                                user_id_to_update = user_auth.get_id_by_name(username=username_from_login)
+                                new_name = input("Enter username  to update: ")
+                                new_password = input("Enter new password (press Enter to keep current password): ") or None
+                                new_role = input("Enter new role (press Enter to keep current role): ") or None
+                                try:
+                                    user_auth.update_user(user_id_to_update,new_name, new_password, new_role, actor=username)
+                                    print(f"User with ID {user_id_to_update} updated successfully.")
+                                except PermissionDenied as e:
+                                    print(e)
+                            elif employee_choice == "6":
+                                #    
+                                break
+
+                            else:
+                                print("Invalid choice. Please try again.")
+                        except PermissionDenied as e:
+                            #      
+                            print(e)
                 elif role == "admin":
                     while True:
+                        #       (update_user):    
+                        if session.role != role:
+                            print("Your role has changed. Please log in again.")
+                            break
                         #    
                         print("\nAdmin Actions:")
-                        print("1. View All Users\n2. Delete User\n3. Update User\n4. Configure user's data\n5. Exit Admin Panel")
+                        print("1. View All Users\n2. Delete User\n3. Update User\n4. Configure user's data\n5. View Query Stats\n6. View Sales Report\n7. View Audit Log\n8. Exit Admin Panel")
 
                         admin_choice = input("Enter your choice: ")
 
-                        if admin_choice == "1":
-                            #   
-                            all_users = user_auth.get_all_users()
-                            print("\nAll Users:")
-                            for user in all_users:
-                                print(user)
-
-                        elif admin_choice == "2":
-                            #  
-                            user_id_to_delete = int(input("Enter user ID to delete: "))
-                            user_auth.delete_user(user_id_to_delete)
-                            print(f"User with ID {user_id_to_delete} deleted successfully.")
-
-                        elif admin_choice == "3":
-                            #   
-                            user_id_to_update = input("Enter user ID to update: ")
-                            new_name = input("Enter username  to update: ")
-                            new_password = input("Enter new password (press Enter to keep current password): ")
-                            new_role = input("Enter new role (press Enter to keep current role): ")
-                            user_auth.update_user(user_id_to_update,new_name, new_password, new_role)
-                            print(f"User with ID {user_id_to_update} updated successfully.")
-
-                        elif admin_choice == "4":
-                            #   
-                            new_username = input("Enter username: ")
-                            new_password = input("Enter password: ")
-                            new_role = input("Enter role (client, employee, admin): ")
-                            user_auth.register_user( new_username, new_password, new_role)
+                        try:
+                            if admin_choice == "1":
+                                #   
+                                print("\nAll Users:")
+                                for user in user_auth.iter_users(columns=("id", "username", "role")):
+                                    print(user)
+
+                            elif admin_choice == "2":
+                                #  
+                                user_id_to_delete = int(input("Enter user ID to delete: "))
+                                user_auth.delete_user(user_id_to_delete, actor=username)
+                                print(f"User with ID {user_id_to_delete} deleted successfully.")
+
+                            elif admin_choice == "3":
+                                #   
+                                user_id_to_update = input("Enter user ID to update: ")
+                                new_name = input("Enter username  to update: ")
+                                new_password = input("Enter new password (press Enter to keep current password): ") or None
+                                new_role = input("Enter new role (press Enter to keep current role): ") or None
+                                try:
+                                    user_auth.update_user(user_id_to_update,new_name, new_password, new_role, actor=username)
+                                    print(f"User with ID {user_id_to_update} updated successfully.")
+                                except PermissionDenied as e:
+                                    print(e)
+
+                            elif admin_choice == "4":
+                                #   
+                                new_username = input("Enter username: ")
+                                new_password = input("Enter password: ")
+                                new_role = input("Enter role (client, employee, admin): ")
+                                user_auth.register_user( new_username, new_password, new_role)
                             
-                            print(f"User '{new_username}' is added successfully.")
-
-                        elif admin_choice == "5":
-                            #   -
-                            print("Exiting Admin Panel.")
-                            break
-
-                        else:
-                            print("Invalid choice. Please try again.")
+                                print(f"User '{new_username}' is added successfully.")
+
+                            elif admin_choice == "5":
+                                #      
+                                for title, source in (("Shop", jewelry_shop), ("Users", user_auth)):
+                                    stats = source.get_query_stats()
+                                    print(f"\n{title} query stats:")
+                                    if not stats["enabled"]:
+                                        print("Query stats are disabled.")
+                                    for entry in stats["statements"]:
+                                        print(f"{entry['calls']:>8} calls  {entry['total_seconds'] * 1000:>10.2f} ms total  "
+                                              f"{entry['max_seconds'] * 1000:>8.2f} ms max  {entry['rows']:>8} rows  "
+                                              f"{entry['sql']}")
+                                    for slow in stats["slow_queries"]:
+                                        print(f"SLOW {slow['seconds'] * 1000:.2f} ms: {slow['sql']} -> {slow['plan']}")
+                                stats_action = input("Enable (e), disable (d) or reset (r) stats, or press Enter: ")
+                                for source in (jewelry_shop, user_auth):
+                                    if stats_action == "e":
+                                        source.pool.stats.enabled = True
+                                    elif stats_action == "d":
+                                        source.pool.stats.enabled = False
+                                    elif stats_action == "r":
+                                        source.reset_query_stats()
+
+                            elif admin_choice == "6":
+                                #     
+                                report = SalesReport(jewelry_shop)
+                                if input("Rebuild aggregates from order history first? (y/N): ") == "y":
+                                    report.rebuild()
+                                totals = report.totals()
+                                print(f"\nOrders: {totals['orders']}  Units: {totals['units']}  Revenue: {totals['revenue']:.2f}")
+                                print("\nTop products (name, units, revenue):")
+                                for product in report.top_products():
+                                    print(product)
+                                print("\nTop customers (name, orders, revenue):")
+                                for customer in report.top_customers():
+                                    print(customer)
+
+                            elif admin_choice == "7":
+                                #     
+                                audit = jewelry_shop.audit or user_auth.audit
+                                if audit is None:
+                                    print("Audit log is not configured.")
+                                    continue
+                                actor_filter = input("Filter by actor (press Enter for all): ") or None
+                                entity_filter = input("Filter by entity: product, user (press Enter for all): ") or None
+                                for event in audit.query(actor=actor_filter, entity=entity_filter):
+                                    print(event)
+
+                            elif admin_choice == "8":
+                                #   -
+                                print("Exiting Admin Panel.")
+                                break
+
+                            else:
+                                print("Invalid choice. Please try again.")
+                        except PermissionDenied as e:
+                            #      
+                            print(e)
+                session.deactivate()
 
             else:
                 print("Authentication failed. Please try again.")
@@ -542,8 +1288,6 @@ def main():
 
 
 if __name__ == "__main__":
-    jewelry_shop = JewelryShop()
-    user_auth = UserAuthentication()
     main()
 
 
@@ -0,0 +1,90 @@
+"""
+Асинхронный (asyncio) фасад над JewelryShop для конкурентных front-end'ов.
+
+Изменяющие методы выполняются в одном потоке-писателе: у него своё соединение из пула
+JewelryShop, поэтому записи идут строго по очереди и не борются за блокировку базы.
+Читающие методы выполняются в пуле потоков-читателей, каждый со своим соединением;
+в режиме WAL они не ждут писателя.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from Python4 import FILTER_PAGE_SIZE, JewelryShop
+
+
+class ShopOverloadedError(RuntimeError):
+    """
+    В очереди уже max_pending вызовов; запрос отклонён, чтобы не накапливать ожидающие потоки.
+    """
+
+
+class AsyncJewelryShop:
+    def __init__(self, shop: JewelryShop = None, database_path: str = "jewelry_shop.db",
+                 readers: int = 4, max_pending: int = 64) -> None:
+        """
+        Инициализация фасада.
+
+        :param shop: обёртываемый магазин; по умолчанию создаётся для database_path.
+        :param readers: число потоков (и соединений) для чтения.
+        :param max_pending: максимальное число одновременно ожидающих вызовов (глубина очереди).
+        """
+        self.shop = shop if shop is not None else JewelryShop(database_path)
+        self.max_pending = max_pending
+        self._pending = 0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shop-writer")
+        self._readers = ThreadPoolExecutor(max_workers=readers, thread_name_prefix="shop-reader")
+
+    @property
+    def pending(self) -> int:
+        """
+        Текущая глубина очереди: вызовы, принятые, но ещё не завершённые.
+        """
+        return self._pending
+
+    async def _submit(self, executor: ThreadPoolExecutor, method, *args, **kwargs):
+        if self._pending >= self.max_pending:
+            raise ShopOverloadedError(f"Слишком много ожидающих запросов ({self._pending}).")
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Вызов выполняется в контексте вызывающей задачи: в нём активная сессия (см. permissions)
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(executor, functools.partial(context.run, method, *args, **kwargs))
+        finally:
+            self._pending -= 1
+
+    async def add_product(self, name: str, price: float, quantity: int):
+        return await self._submit(self._writer, self.shop.add_product, name, price, quantity)
+
+    async def create_order(self, customer_name: str, products: dict):
+        return await self._submit(self._writer, self.shop.create_order, customer_name, products)
+
+    async def create_orders(self, orders) -> list:
+        return await self._submit(self._writer, self.shop.create_orders, list(orders))
+
+    async def delete_order(self, order_id: int):
+        return await self._submit(self._writer, self.shop.delete_order, order_id)
+
+    async def get_available_products(self) -> list:
+        return await self._submit(self._readers, self.shop.get_available_products)
+
+    async def filter_products(self, min_price=None, max_price=None, min_quantity=None, max_quantity=None,
+                              order_by: str = "price", descending: bool = False, limit: int = FILTER_PAGE_SIZE,
+                              after: tuple = None) -> list:
+        return await self._submit(self._readers, self.shop.filter_products, min_price, max_price,
+                                  min_quantity, max_quantity, order_by, descending, limit, after)
+
+    def close(self) -> None:
+        """
+        Ожидание завершения принятых вызовов и остановка потоков.
+        """
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
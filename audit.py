@@ -0,0 +1,138 @@
+"""
+Журнал аудита: кто и когда изменил товары и пользователей.
+
+record() только кладёт событие в кольцевой буфер в памяти и не обращается к базе;
+фоновый поток пачками записывает события в таблицу audit_events отдельной базы
+(по умолчанию audit.db), которая только дополняется. Оставшиеся в буфере события
+записываются при close() и при завершении процесса (atexit).
+"""
+import atexit
+import json
+import threading
+import time
+from collections import deque
+
+from database import ConnectionPool
+from migrations import AUDIT_MIGRATIONS, ensure_schema
+
+AUDIT_QUERY_LIMIT = 100
+
+
+class AuditLog:
+    def __init__(self, database_path: str = "audit.db", capacity: int = 10000, flush_interval: float = 1.0,
+                 batch_size: int = 500) -> None:
+        """
+        Инициализация журнала. База и фоновый поток создаются при первом событии.
+
+        :param capacity: размер кольцевого буфера; если запись отстаёт, самые старые события вытесняются.
+        :param flush_interval: как часто (в секундах) фоновый поток записывает накопленные события.
+        :param batch_size: при таком числе событий в буфере запись начинается, не дожидаясь интервала.
+        """
+        self.pool = ConnectionPool(database_path)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dropped = 0
+        self._buffer = deque(maxlen=capacity)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def conn(self):
+        conn = self.pool.get()
+        ensure_schema(conn, AUDIT_MIGRATIONS)
+        return conn
+
+    def record(self, action: str, entity: str, entity_id=None, actor: str = None, **details) -> None:
+        """
+        Добавление события в буфер.
+
+        :param action: действие (add, update, delete, ...).
+        :param entity: тип объекта (product, user, ...).
+        :param entity_id: идентификатор объекта (id или название).
+        :param actor: кто выполнил действие.
+        :param details: дополнительные поля события (сохраняются как JSON).
+        """
+        if self._thread is None:
+            self._start()
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((time.time(), actor, action, entity,
+                             None if entity_id is None else str(entity_id),
+                             json.dumps(details, ensure_ascii=False, default=str) if details else None))
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self) -> int:
+        """
+        Запись всех событий из буфера одной транзакцией.
+
+        :return: число записанных событий.
+        """
+        with self._flush_lock:
+            batch = [self._buffer.popleft() for _ in range(len(self._buffer))]
+            if not batch:
+                return 0
+            conn = self.conn
+            try:
+                conn.executemany("INSERT INTO audit_events (at, actor, action, entity, entity_id, details) "
+                                 "VALUES (?, ?, ?, ?, ?, ?)", batch)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                # События возвращаются в начало буфера и будут записаны при следующей попытке
+                self._buffer.extendleft(reversed(batch))
+                raise
+            return len(batch)
+
+    def query(self, actor: str = None, entity: str = None, entity_id=None, since: float = None,
+              until: float = None, limit: int = AUDIT_QUERY_LIMIT) -> list:
+        """
+        Поиск событий, новые первыми. Ещё не записанные события предварительно записываются.
+
+        :param since: начало интервала (time.time()), включительно.
+        :param until: конец интервала, не включительно.
+        :return: список кортежей (id, at, actor, action, entity, entity_id, details).
+        """
+        self.flush()
+        conditions = []
+        parameters = []
+        for condition, value in (("actor = ?", actor), ("entity = ?", entity),
+                                 ("entity_id = ?", None if entity_id is None else str(entity_id)),
+                                 ("at >= ?", since), ("at < ?", until)):
+            if value is not None:
+                conditions.append(condition)
+                parameters.append(value)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor = self.conn.cursor()
+        cursor.execute(f"SELECT id, at, actor, action, entity, entity_id, details FROM audit_events{where} "
+                       "ORDER BY at DESC LIMIT ?", parameters + [limit])
+        return cursor.fetchall()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="audit-flush", daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _flush_loop(self) -> None:
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+
+    def close(self) -> None:
+        """
+        Остановка фонового потока и запись оставшихся событий.
+        """
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
@@ -0,0 +1,245 @@
+"""
+Нагрузочный замер горячих путей JewelryShop и UserAuthentication.
+
+Заполняет временные базы SQLite синтетическим каталогом, пользователями и историей заказов
+заданного размера, замеряет основные операции и выводит пропускную способность и
+перцентили задержки в формате JSON, чтобы сравнивать прогоны между изменениями.
+
+Пример: python benchmark.py --scale 1000 --scale 100000 --output bench.json
+
+С --check-startup вместо нагрузочного замера проверяется бюджет времени запуска
+(import Python4 и консольного меню до выхода) и то, что запуск не создаёт файлов;
+при превышении бюджета код возврата 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from Python4 import JewelryShop, UserAuthentication
+from passwords import PasswordHasher
+from reporting import SalesReport
+
+BENCH_PASSWORD = "benchmark-password"
+# Бюджет времени запуска в миллисекундах сверх запуска пустого интерпретатора
+IMPORT_BUDGET_MS = 50.0
+CLI_BUDGET_MS = 100.0
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """
+    Перцентиль по методу ближайшего ранга для отсортированного списка.
+    """
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def summarize(durations: list) -> dict:
+    """
+    Сводка замеров одной операции: число вызовов, пропускная способность и задержки в миллисекундах.
+    """
+    ordered = sorted(durations)
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "total_seconds": round(total, 6),
+        "throughput_per_second": round(len(ordered) / total, 2) if total else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 4),
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 4),
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4) if ordered else 0.0,
+    }
+
+
+def measure(operation, arguments) -> list:
+    """
+    Вызов operation(*args) для каждого набора аргументов; печать методов магазина подавляется.
+    """
+    durations = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for args in arguments:
+            started = time.perf_counter()
+            operation(*args)
+            durations.append(time.perf_counter() - started)
+    return durations
+
+
+def seed(shop: JewelryShop, auth: UserAuthentication, scale: int, rng: random.Random) -> None:
+    """
+    Заполнение баз: scale товаров, scale пользователей и scale заказов по 1-3 строки.
+    """
+    shop.bulk_upsert_products((f"SKU-{i:07d}", round(rng.uniform(10, 5000), 2), rng.randint(0, 1000))
+                              for i in range(scale))
+
+    # Хеш считаем один раз: хеширование каждого синтетического пользователя замеряло бы PBKDF2, а не базу
+    stored_password = auth.hasher.hash(BENCH_PASSWORD)
+    conn = auth.conn
+    conn.executemany("INSERT INTO users (username, password, role) VALUES (?, ?, ?)",
+                     ((f"user{i}", stored_password, "client") for i in range(scale)))
+    conn.commit()
+
+    conn = shop.conn
+    batch = 10000
+    for start in range(0, scale, batch):
+        orders = [(start + i + 1, f"user{rng.randrange(scale)}", 0.0) for i in range(min(batch, scale - start))]
+        conn.executemany("INSERT INTO orders (id, customer_name, total_price) VALUES (?, ?, ?)", orders)
+        conn.executemany("INSERT INTO order_items (order_id, product_id, quantity) VALUES (?, ?, ?)",
+                         ((order_id, rng.randint(1, scale), rng.randint(1, 3))
+                          for order_id, _, _ in orders for _ in range(rng.randint(1, 3))))
+        conn.commit()
+    # Название и цена строк заказа - как у товара; агрегаты отчётов пересчитываются по засеянной истории
+    conn.execute('''
+        UPDATE order_items SET
+            product_name = (SELECT name FROM products WHERE products.id = order_items.product_id),
+            unit_price = (SELECT price FROM products WHERE products.id = order_items.product_id)
+    ''')
+    conn.commit()
+    SalesReport(shop).rebuild()
+
+
+def run_scale(scale: int, operations: int, hash_iterations: int, directory: str, rng: random.Random) -> dict:
+    """
+    Полный прогон для одного размера данных.
+    """
+    shop = JewelryShop(os.path.join(directory, f"shop_{scale}.db"))
+    auth = UserAuthentication(os.path.join(directory, f"users_{scale}.db"),
+                              hasher=PasswordHasher(iterations=hash_iterations))
+    started = time.perf_counter()
+    seed(shop, auth, scale, rng)
+    seed_seconds = time.perf_counter() - started
+
+    # Полный просмотр каталога на больших масштабах дорогой, поэтому замеров меньше
+    full_scans = max(3, operations // 20)
+    product_names = [f"SKU-{rng.randrange(scale):07d}" for _ in range(operations)]
+    results = {
+        "add_product": measure(shop.add_product,
+                               [(f"NEW-{i:07d}", 100.0, 10) for i in range(operations)]),
+        "filter_products": measure(shop.filter_products,
+                                   [(low, low + 500, 1) for low in
+                                    (rng.uniform(10, 4500) for _ in range(operations))]),
+        "search_products": measure(shop.search_products,
+                                   [(f"SKU {rng.randrange(scale):07d}"[:rng.randint(5, 12)],)
+                                    for _ in range(operations)]),
+        # Холодный вызов - запрос к базе (кэш сбрасывается перед каждым замером); тёплый - готовый список из кэша
+        "get_available_products": measure(lambda: (shop.product_cache.clear(), shop.get_available_products()),
+                                          [()] * full_scans),
+        "get_available_products_cached": measure(lambda: shop.get_available_products(),
+                                                 [()] * full_scans),
+        "create_order": measure(shop.create_order,
+                                [(f"user{rng.randrange(scale)}",
+                                  {name: 1 for name in rng.sample(product_names, rng.randint(1, 3))})
+                                 for _ in range(operations)]),
+        "delete_order": measure(shop.delete_order,
+                                [(order_id,) for order_id in rng.sample(range(1, scale + 1),
+                                                                        min(operations, scale))]),
+        "register_user": measure(auth.register_user,
+                                 [(f"new-user{i}", BENCH_PASSWORD, "client") for i in range(operations)]),
+        "authenticate_user": measure(auth.authenticate_user,
+                                     [(f"user{rng.randrange(scale)}", BENCH_PASSWORD, "client")
+                                      for _ in range(operations)]),
+    }
+    shop.pool.close_all()
+    auth.pool.close_all()
+    auth.hasher.shutdown()
+    return {
+        "scale": scale,
+        "seed_seconds": round(seed_seconds, 3),
+        "operations": {name: summarize(durations) for name, durations in results.items()},
+    }
+
+
+def measure_startup(runs: int = 5) -> dict:
+    """
+    Медианное время (мс) запуска отдельного процесса: пустого интерпретатора, "import Python4"
+    и консольного меню до выбора Exit, а также файлы, которые запуск оставил в рабочем каталоге.
+    """
+    package_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, PYTHONPATH=package_dir)
+    commands = {
+        "baseline": ([sys.executable, "-c", "pass"], None),
+        "import": ([sys.executable, "-c", "import Python4"], None),
+        "cli": ([sys.executable, os.path.join(package_dir, "Python4.py")], "3\n"),
+    }
+    with tempfile.TemporaryDirectory(prefix="jewelry-startup-") as directory:
+        timings = {}
+        for name, (command, stdin) in commands.items():
+            durations = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                subprocess.run(command, input=stdin, cwd=directory, env=env, check=True,
+                               capture_output=True, text=True)
+                durations.append((time.perf_counter() - started) * 1000)
+            timings[name] = statistics.median(durations)
+        created_files = sorted(os.listdir(directory))
+
+    return {"baseline_ms": round(timings["baseline"], 2),
+            "import_ms": round(timings["import"] - timings["baseline"], 2),
+            "cli_ms": round(timings["cli"] - timings["baseline"], 2),
+            "created_files": created_files}
+
+
+def check_startup(import_budget_ms: float = IMPORT_BUDGET_MS, cli_budget_ms: float = CLI_BUDGET_MS,
+                  runs: int = 5) -> dict:
+    """
+    Проверка бюджета времени запуска (см. measure_startup).
+    return: замеры и список нарушений "violations"; пустой список - бюджет соблюдён.
+    """
+    result = measure_startup(runs)
+    violations = []
+    if result["import_ms"] > import_budget_ms:
+        violations.append(f"import Python4: {result['import_ms']} ms > {import_budget_ms} ms")
+    if result["cli_ms"] > cli_budget_ms:
+        violations.append(f"CLI startup: {result['cli_ms']} ms > {cli_budget_ms} ms")
+    if result["created_files"]:
+        violations.append(f"startup created files: {result['created_files']}")
+    result["violations"] = violations
+    return result
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark JewelryShop and UserAuthentication hot paths.")
+    parser.add_argument("--scale", type=int, action="append",
+                        help="rows per table to seed (repeatable; default: 1000)")
+    parser.add_argument("--operations", type=int, default=200, help="measured calls per operation")
+    parser.add_argument("--hash-iterations", type=int, default=10000,
+                        help="PBKDF2 iterations used for the benchmark users")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for reproducible data")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--check-startup", action="store_true",
+                        help="check the startup-time budget instead of running the benchmark")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS)
+    parser.add_argument("--cli-budget-ms", type=float, default=CLI_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    if args.check_startup:
+        result = check_startup(args.import_budget_ms, args.cli_budget_ms)
+        print(json.dumps(result, indent=2))
+        return 1 if result["violations"] else 0
+
+    rng = random.Random(args.seed)
+    report = {"python": sys.version.split()[0], "operations_per_case": args.operations, "runs": []}
+    with tempfile.TemporaryDirectory(prefix="jewelry-bench-") as directory:
+        for scale in args.scale or [1000]:
+            report["runs"].append(run_scale(scale, args.operations, args.hash_iterations, directory, rng))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
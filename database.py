@@ -0,0 +1,115 @@
+"""
+Фабрика соединений SQLite и потокобезопасный пул соединений,
+общие для JewelryShop и UserAuthentication.
+"""
+import sqlite3
+import threading
+import weakref
+
+from instrumentation import InstrumentedConnection, QueryStats
+
+# Настройки соединения по умолчанию; любую из них можно переопределить в connect() / ConnectionPool
+DEFAULT_PRAGMAS = {
+    "synchronous": "NORMAL",     # в режиме WAL NORMAL безопасен и не делает fsync на каждый commit
+    "cache_size": -16000,        # отрицательное значение - размер кэша страниц в КиБ (16 МиБ)
+    "mmap_size": 268435456,      # 256 МиБ файла базы читаются через mmap
+    "busy_timeout": 5000,        # сколько миллисекунд ждать освобождения блокировки
+    "temp_store": "MEMORY",
+}
+
+
+def connect(database_path: str, stats: QueryStats = None, **pragmas) -> sqlite3.Connection:
+    """
+    Открытие соединения с базой в режиме WAL и с заданными PRAGMA.
+
+    :param database_path: путь к файлу базы данных SQLite.
+    :param stats: статистика запросов этого соединения (см. instrumentation); по умолчанию выключена.
+    :param pragmas: значения PRAGMA, переопределяющие DEFAULT_PRAGMAS.
+    :return: настроенное соединение.
+    """
+    settings = dict(DEFAULT_PRAGMAS, **pragmas)
+    # check_same_thread=False: соединение потока закрывается из другого потока (close_all, сборка мусора)
+    conn = sqlite3.connect(database_path, timeout=settings["busy_timeout"] / 1000, check_same_thread=False,
+                           factory=InstrumentedConnection)
+    if stats is not None:
+        conn.stats = stats
+    conn.execute("PRAGMA journal_mode=WAL")
+    for name, value in settings.items():
+        conn.execute(f"PRAGMA {name}={value}")
+    return conn
+
+
+def begin_immediate(conn: sqlite3.Connection) -> sqlite3.Cursor:
+    """
+    Начало транзакции записи (BEGIN IMMEDIATE сразу берёт блокировку на запись).
+
+    Если на соединении осталась незавершённая транзакция (например, изменения без commit),
+    она откатывается и вызывается ошибка: молча фиксировать чужие изменения нельзя.
+
+    :return: курсор, на котором начата транзакция.
+    :raises sqlite3.ProgrammingError: на соединении была открыта транзакция.
+    """
+    if conn.in_transaction:
+        conn.rollback()
+        raise sqlite3.ProgrammingError("На соединении осталась незавершённая транзакция; она отменена.")
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    return cursor
+
+
+class _ThreadConnection:
+    # Держатель соединения потока в threading.local: когда поток завершается, держатель
+    # уничтожается и weakref.finalize закрывает соединение
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self.conn = conn
+
+
+class ConnectionPool:
+    def __init__(self, database_path: str, stats: QueryStats = None, **pragmas) -> None:
+        """
+        Инициализация пула соединений: у каждого потока своё соединение (см. get).
+
+        :param database_path: путь к файлу базы данных SQLite.
+        :param stats: общая статистика запросов всех соединений пула; по умолчанию своя для пула.
+        :param pragmas: значения PRAGMA для каждого нового соединения.
+        """
+        self.database_path = database_path
+        self.stats = stats if stats is not None else QueryStats()
+        self.pragmas = pragmas
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._all = set()
+
+    def _open(self) -> sqlite3.Connection:
+        conn = connect(self.database_path, self.stats, **self.pragmas)
+        with self._lock:
+            self._all.add(conn)
+        return conn
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._all.discard(conn)
+        conn.close()
+
+    def get(self) -> sqlite3.Connection:
+        """
+        Получение соединения, закреплённого за текущим потоком (создаётся при первом обращении).
+        Соединение закрывается, когда поток завершается.
+        """
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = self._local.holder = _ThreadConnection(self._open())
+            weakref.finalize(holder, self._discard, holder.conn)
+        return holder.conn
+
+    def close_all(self) -> None:
+        """
+        Закрытие всех соединений, открытых пулом.
+        """
+        with self._lock:
+            connections, self._all = self._all, set()
+        self._local = threading.local()
+        for conn in connections:
+            conn.close()
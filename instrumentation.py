@@ -0,0 +1,172 @@
+"""
+Статистика выполнения SQL-запросов и журнал медленных запросов.
+
+Соединения, открытые через database.connect, используют InstrumentedConnection: каждый
+execute/executemany и все fetch* проходят через QueryStats соединения. Пока статистика
+выключена, обёртка сводится к одной проверке флага.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+
+# logging и re импортируются при первом использовании: пока статистика выключена, они не нужны,
+# а их импорт заметно удлиняет запуск
+SLOW_QUERY_LOGGER = "jewelry_shop.slow_query"
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Ключ запроса в статистике: пробелы схлопываются, списки "IN (?, ?, ...)" любой длины считаются одним запросом.
+    """
+    import re
+    return re.sub(r"\(\?(?:, \?)+\)", "(?, ...)", re.sub(r"\s+", " ", sql).strip())
+
+
+class QueryStats:
+    def __init__(self, enabled: bool = None, slow_threshold: float = 0.05, slow_log_size: int = 100) -> None:
+        """
+        Инициализация статистики.
+
+        :param enabled: собирать ли статистику; по умолчанию - если задана переменная окружения SHOP_QUERY_STATS=1.
+        :param slow_threshold: порог в секундах, начиная с которого запрос попадает в журнал медленных.
+        :param slow_log_size: сколько последних медленных запросов хранить.
+        """
+        self.enabled = os.environ.get("SHOP_QUERY_STATS") == "1" if enabled is None else enabled
+        self.slow_threshold = slow_threshold
+        self._lock = threading.Lock()
+        self._statements = {}
+        self._slow = deque(maxlen=slow_log_size)
+
+    def _entry(self, sql: str) -> dict:
+        key = normalize_sql(sql)
+        entry = self._statements.get(key)
+        if entry is None:
+            entry = self._statements[key] = {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0, "rows": 0}
+        return entry
+
+    def record(self, sql: str, elapsed: float, rows: int = 0) -> None:
+        """
+        Учёт одного выполнения запроса.
+        """
+        with self._lock:
+            entry = self._entry(sql)
+            entry["calls"] += 1
+            entry["total_seconds"] += elapsed
+            entry["rows"] += rows
+            if elapsed > entry["max_seconds"]:
+                entry["max_seconds"] = elapsed
+
+    def add_rows(self, sql: str, rows: int) -> None:
+        """
+        Учёт строк, полученных из курсора после выполнения запроса sql.
+        """
+        with self._lock:
+            self._entry(sql)["rows"] += rows
+
+    def record_slow(self, sql: str, elapsed: float, plan: list) -> None:
+        """
+        Запись медленного запроса вместе с его планом (EXPLAIN QUERY PLAN).
+        """
+        event = {"sql": normalize_sql(sql), "seconds": elapsed, "plan": plan, "at": time.time()}
+        with self._lock:
+            self._slow.append(event)
+        import logging
+        logging.getLogger(SLOW_QUERY_LOGGER).warning("slow query (%.1f ms): %s; plan: %s", elapsed * 1000, event["sql"], plan)
+
+    def dump(self) -> dict:
+        """
+        Снимок статистики: запросы, отсортированные по суммарному времени, и журнал медленных запросов.
+        """
+        with self._lock:
+            statements = sorted(({"sql": sql, **entry} for sql, entry in self._statements.items()),
+                                key=lambda entry: entry["total_seconds"], reverse=True)
+            return {"enabled": self.enabled, "slow_threshold": self.slow_threshold,
+                    "statements": statements, "slow_queries": list(self._slow)}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._statements.clear()
+            self._slow.clear()
+
+
+# Статистика по умолчанию для соединений, которым не передали свою
+DISABLED_STATS = QueryStats(enabled=False)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    _last_sql = None
+
+    def execute(self, sql, parameters=()):
+        stats = self.connection.stats
+        if not stats.enabled:
+            return super().execute(sql, parameters)
+        started = time.perf_counter()
+        super().execute(sql, parameters)
+        elapsed = time.perf_counter() - started
+        self._last_sql = sql
+        stats.record(sql, elapsed, max(self.rowcount, 0))
+        if elapsed >= stats.slow_threshold:
+            stats.record_slow(sql, elapsed, self._explain(sql, parameters))
+        return self
+
+    def executemany(self, sql, seq_of_parameters):
+        stats = self.connection.stats
+        if not stats.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        started = time.perf_counter()
+        super().executemany(sql, seq_of_parameters)
+        elapsed = time.perf_counter() - started
+        self._last_sql = None
+        stats.record(sql, elapsed, max(self.rowcount, 0))
+        if elapsed >= stats.slow_threshold:
+            stats.record_slow(sql, elapsed, None)
+        return self
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None and self._last_sql is not None and self.connection.stats.enabled:
+            self.connection.stats.add_rows(self._last_sql, 1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if rows and self._last_sql is not None and self.connection.stats.enabled:
+            self.connection.stats.add_rows(self._last_sql, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if rows and self._last_sql is not None and self.connection.stats.enabled:
+            self.connection.stats.add_rows(self._last_sql, len(rows))
+        return rows
+
+    def _explain(self, sql: str, parameters) -> list:
+        # Отдельный неинструментированный курсор, чтобы план не попадал в статистику
+        try:
+            plan = sqlite3.Cursor(self.connection).execute("EXPLAIN QUERY PLAN " + sql, parameters).fetchall()
+        except sqlite3.Error:
+            return None
+        return [row[-1] for row in plan]
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    stats = DISABLED_STATS
+
+    def cursor(self, factory=None):
+        # При выключенной статистике - обычный курсор без накладных расходов Python-обёртки;
+        # курсор, созданный до включения статистики, в неё не попадает
+        if factory is None:
+            factory = InstrumentedCursor if self.stats.enabled else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not self.stats.enabled:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not self.stats.enabled:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,330 @@
+"""
+Генератор нагрузки: сценарии консольного меню, выполняемые параллельно несколькими процессами.
+
+Каждый процесс-исполнитель работает с общими файлами баз через JewelryShop, Cart и
+UserAuthentication (с включённой проверкой прав, как в main()) и в течение заданного времени
+выбирает сценарии в заданной пропорции:
+    client   - регистрация, вход, просмотр каталога, корзина, оформление заказа;
+    employee - вход, поиск заканчивающихся товаров, пополнение остатка;
+    admin    - вход, просмотр пользователей, создание, изменение и удаление сотрудника.
+
+Результат в формате JSON: пропускная способность, доля ошибок и ошибок занятой базы
+(SQLITE_BUSY / SQLITE_LOCKED) и гистограммы задержек по каждой операции.
+
+Пример: python loadgen.py --workers 8 --duration 30 --mix client=8,employee=1,admin=1
+"""
+import argparse
+import bisect
+import contextlib
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+from database import ConnectionPool
+from passwords import PasswordHasher
+from permissions import Authorizer
+from Python4 import Cart, JewelryShop, UserAuthentication
+from reservations import is_busy_error
+
+LOAD_PASSWORD = "load-password"
+ADMIN_NAME = "load-admin"
+EMPLOYEE_NAME = "load-employee"
+DEFAULT_MIX = {"client": 8, "employee": 1, "admin": 1}
+# Верхние границы интервалов гистограммы задержек, мс; последний интервал - всё, что дольше
+LATENCY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+
+class FlowAborted(Exception):
+    """
+    Операция сценария завершилась ошибкой; остаток сценария пропускается.
+    """
+
+
+class OperationStats:
+    __slots__ = ("count", "errors", "lock_timeouts", "total", "max", "buckets")
+
+    def __init__(self) -> None:
+        """
+        Счётчики одной операции. Задержки хранятся гистограммой, поэтому память не растёт с числом вызовов.
+        """
+        self.count = 0
+        self.errors = 0
+        self.lock_timeouts = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def add(self, seconds: float, error: Exception = None) -> None:
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+        if error is not None:
+            self.errors += 1
+            if is_busy_error(error):
+                self.lock_timeouts += 1
+
+    def merge(self, other: "OperationStats") -> None:
+        self.count += other.count
+        self.errors += other.errors
+        self.lock_timeouts += other.lock_timeouts
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+
+    def percentile(self, fraction: float) -> float:
+        """
+        Оценка перцентиля (мс) по гистограмме: верхняя граница интервала, в который попадает ранг.
+        """
+        rank = max(1, round(fraction * self.count))
+        for bound, seen in zip(LATENCY_BUCKETS_MS, itertools.accumulate(self.buckets)):
+            if seen >= rank:
+                return min(float(bound), self.max * 1000)
+        return self.max * 1000
+
+    def summary(self, seconds: float) -> dict:
+        labels = [f"<={bound}" for bound in LATENCY_BUCKETS_MS] + [f">{LATENCY_BUCKETS_MS[-1]}"]
+        return {
+            "count": self.count,
+            "throughput_per_second": round(self.count / seconds, 2) if seconds else None,
+            "error_rate": round(self.errors / self.count, 4) if self.count else 0.0,
+            "lock_timeout_rate": round(self.lock_timeouts / self.count, 4) if self.count else 0.0,
+            "mean_ms": round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.50), 3),
+            "p95_ms": round(self.percentile(0.95), 3),
+            "p99_ms": round(self.percentile(0.99), 3),
+            "max_ms": round(self.max * 1000, 3),
+            "histogram_ms": {label: count for label, count in zip(labels, self.buckets) if count},
+        }
+
+
+class Worker:
+    def __init__(self, number: int, config: dict) -> None:
+        """
+        Исполнитель сценариев одного процесса.
+
+        :param config: параметры прогона (см. run_load).
+        """
+        self.number = number
+        self.rng = random.Random(config["seed"] * 1000 + number)
+        busy_timeout = config["busy_timeout_ms"]
+        self.shop = JewelryShop(config["shop"], pool=ConnectionPool(config["shop"], busy_timeout=busy_timeout))
+        self.auth = UserAuthentication(config["users"], pool=ConnectionPool(config["users"], busy_timeout=busy_timeout),
+                                       hasher=PasswordHasher(iterations=config["hash_iterations"], workers=1))
+        Authorizer(self.auth).protect(self.shop, self.auth)
+        self.product_names = [f"LOAD-{i:05d}" for i in range(config["products"])]
+        self.operations = {}
+        self.flows = {}
+        self._sequence = itertools.count()
+
+    def call(self, operation: str, method, *args, **kwargs):
+        """
+        Замер одного вызова; ошибка учитывается в статистике операции и прерывает сценарий.
+        """
+        stats = self.operations.get(operation)
+        if stats is None:
+            stats = self.operations[operation] = OperationStats()
+        started = time.perf_counter()
+        try:
+            result = method(*args, **kwargs)
+        except Exception as e:
+            stats.add(time.perf_counter() - started, e)
+            raise FlowAborted(operation) from e
+        stats.add(time.perf_counter() - started)
+        return result
+
+    def login(self, username: str):
+        session = self.call("login", self.auth.login, username, LOAD_PASSWORD)
+        if session is None:
+            raise FlowAborted("login")
+        return session
+
+    def client_flow(self) -> None:
+        username = f"load-client-{self.number}-{next(self._sequence)}"
+        self.call("register", self.auth.register_user, username, LOAD_PASSWORD, "client")
+        with self.login(username):
+            low = self.rng.uniform(10, 4000)
+            self.call("browse", self.shop.filter_products, low, low + 1000, 1)
+            self.call("search", self.shop.search_products, self.rng.choice(self.product_names)[:8])
+            cart = Cart(self.shop)
+            for name in self.rng.sample(self.product_names, self.rng.randint(1, 3)):
+                self.call("add_to_cart", cart.add_item, name, self.rng.randint(1, 3))
+            order_id, _ = self.call("checkout", self.shop.create_order, username, cart)
+            if order_id is None:
+                # Товара не хватило: это не ошибка, а ожидаемый отказ
+                self.flows["client"]["rejected"] += 1
+
+    def employee_flow(self) -> None:
+        with self.login(EMPLOYEE_NAME):
+            low_stock = self.call("low_stock", self.shop.filter_products, max_quantity=5)
+            names = [product[1] for product in low_stock] or [self.rng.choice(self.product_names)]
+            self.call("restock", self.shop.update_product, self.rng.choice(names),
+                      new_quantity=self.rng.randint(50, 200), actor=EMPLOYEE_NAME)
+
+    def admin_flow(self) -> None:
+        username = f"load-staff-{self.number}-{next(self._sequence)}"
+        with self.login(ADMIN_NAME):
+            self.call("list_users", lambda: list(itertools.islice(self.auth.iter_users(("id", "username", "role")),
+                                                                   100)))
+            self.call("create_staff", self.auth.register_user, username, LOAD_PASSWORD, "employee")
+            user_id = self.call("find_user", self.auth.get_id_by_name, username)
+            if user_id is None:
+                raise FlowAborted("find_user")
+            self.call("update_user", self.auth.update_user, user_id, new_role="client", actor=ADMIN_NAME)
+            self.call("delete_user", self.auth.delete_user, user_id, actor=ADMIN_NAME)
+
+    def run(self, mix: dict, duration: float) -> dict:
+        flows = {"client": self.client_flow, "employee": self.employee_flow, "admin": self.admin_flow}
+        names = list(mix)
+        weights = [mix[name] for name in names]
+        self.flows = {name: {"started": 0, "completed": 0, "failed": 0, "rejected": 0} for name in names}
+        deadline = time.perf_counter() + duration
+        # Методы магазина печатают сообщения меню; при нагрузке они не нужны
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            while time.perf_counter() < deadline:
+                name = self.rng.choices(names, weights)[0]
+                self.flows[name]["started"] += 1
+                try:
+                    flows[name]()
+                    self.flows[name]["completed"] += 1
+                except FlowAborted:
+                    self.flows[name]["failed"] += 1
+        self.shop.pool.close_all()
+        self.auth.pool.close_all()
+        self.auth.hasher.shutdown()
+        return {"operations": self.operations, "flows": self.flows}
+
+
+def _run_worker(number: int, config: dict) -> dict:
+    return Worker(number, config).run(config["mix"], config["duration"])
+
+
+def prepare(config: dict) -> None:
+    """
+    Подготовка баз: каталог из config["products"] товаров, администратор и сотрудник для сценариев.
+    Уже существующие товары и пользователи не изменяются.
+    """
+    shop = JewelryShop(config["shop"])
+    auth = UserAuthentication(config["users"], hasher=PasswordHasher(iterations=config["hash_iterations"]))
+    rng = random.Random(config["seed"])
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        shop.conn.executemany("INSERT OR IGNORE INTO products (name, price, quantity) VALUES (?, ?, ?)",
+                              ((f"LOAD-{i:05d}", round(rng.uniform(10, 5000), 2), config["stock"])
+                               for i in range(config["products"])))
+        shop.conn.commit()
+        if auth.get_id_by_name(ADMIN_NAME) is None:
+            auth.conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, 'admin')",
+                              (ADMIN_NAME, auth.hasher.hash(LOAD_PASSWORD)))
+        if auth.get_id_by_name(EMPLOYEE_NAME) is None:
+            auth.conn.execute("INSERT INTO users (username, password, role) VALUES (?, ?, 'employee')",
+                              (EMPLOYEE_NAME, auth.hasher.hash(LOAD_PASSWORD)))
+        auth.conn.commit()
+    shop.pool.close_all()
+    auth.pool.close_all()
+    auth.hasher.shutdown()
+
+
+def run_load(shop: str, users: str, workers: int = 4, duration: float = 10.0, mix: dict = None,
+             products: int = 200, stock: int = 1000, hash_iterations: int = 1000, busy_timeout_ms: int = 5000,
+             seed: int = 0) -> dict:
+    """
+    Прогон нагрузки: workers процессов в течение duration секунд выполняют сценарии в пропорции mix.
+
+    :param mix: {сценарий: вес}; сценарии - client, employee, admin.
+    :param hash_iterations: число итераций PBKDF2 для паролей пользователей прогона.
+    :param busy_timeout_ms: сколько соединение ждёт блокировку базы, прежде чем вернуть SQLITE_BUSY.
+    :return: сводка прогона (см. описание модуля).
+    """
+    mix = dict(DEFAULT_MIX if mix is None else mix)
+    config = {"shop": shop, "users": users, "mix": mix, "duration": duration, "products": products,
+              "stock": stock, "hash_iterations": hash_iterations, "busy_timeout_ms": busy_timeout_ms, "seed": seed}
+    prepare(config)
+
+    # spawn: дочерние процессы открывают свои соединения, а не наследуют соединения родителя
+    context = multiprocessing.get_context("spawn")
+    started = time.perf_counter()
+    with context.Pool(workers) as pool:
+        results = pool.starmap(_run_worker, [(number, config) for number in range(workers)])
+    elapsed = time.perf_counter() - started
+
+    operations = {}
+    flows = {}
+    for result in results:
+        for name, stats in result["operations"].items():
+            operations.setdefault(name, OperationStats()).merge(stats)
+        for name, counters in result["flows"].items():
+            total = flows.setdefault(name, dict.fromkeys(counters, 0))
+            for key, value in counters.items():
+                total[key] += value
+    overall = OperationStats()
+    for stats in operations.values():
+        overall.merge(stats)
+    summary = overall.summary(duration)
+    return {
+        "workers": workers,
+        "duration_seconds": duration,
+        "elapsed_seconds": round(elapsed, 3),
+        "mix": mix,
+        "totals": {key: summary[key] for key in ("count", "throughput_per_second", "error_rate",
+                                                  "lock_timeout_rate", "p50_ms", "p95_ms", "p99_ms", "max_ms")},
+        "flows": flows,
+        "operations": {name: stats.summary(duration) for name, stats in sorted(operations.items())},
+    }
+
+
+def parse_mix(text: str) -> dict:
+    """
+    Разбор пропорции сценариев вида "client=8,employee=1,admin=1".
+    """
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown flow {name!r}; expected one of {', '.join(DEFAULT_MIX)}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"invalid weight for {name!r}: {weight!r}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise argparse.ArgumentTypeError("at least one flow needs a positive weight")
+    return mix
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Drive the shop workflows from several processes at once.")
+    parser.add_argument("--workers", type=int, default=4, help="worker processes")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds each worker runs")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="flow weights, e.g. client=8,admin=1")
+    parser.add_argument("--shop", help="shop database (default: a temporary file)")
+    parser.add_argument("--users", help="users database (default: a temporary file)")
+    parser.add_argument("--products", type=int, default=200, help="catalogue size seeded before the run")
+    parser.add_argument("--stock", type=int, default=1000, help="initial quantity of each seeded product")
+    parser.add_argument("--hash-iterations", type=int, default=1000, help="PBKDF2 iterations for load users")
+    parser.add_argument("--busy-timeout-ms", type=int, default=5000, help="SQLite busy_timeout per connection")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for reproducible runs")
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="jewelry-load-") as directory:
+        report = run_load(args.shop or os.path.join(directory, "shop.db"),
+                          args.users or os.path.join(directory, "users.db"),
+                          args.workers, args.duration, args.mix, args.products, args.stock,
+                          args.hash_iterations, args.busy_timeout_ms, args.seed)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""
+Версионированные миграции схемы баз JewelryShop, UserAuthentication и журнала аудита.
+
+Номер последней применённой миграции хранится в PRAGMA user_version. Миграция -
+функция, получающая курсор; миграции применяются по порядку, каждая в своей транзакции.
+Новые миграции добавляются только в конец списка.
+"""
+import sqlite3
+import threading
+import weakref
+
+from database import begin_immediate
+
+# Соединения, на которых схема уже проверена: соединение -> id проверенных списков миграций.
+# Ключ - соединение, а не путь: базу, удалённую и созданную заново по тому же пути,
+# новое соединение проверит снова
+_ready = weakref.WeakKeyDictionary()
+_ready_lock = threading.Lock()
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, migrations: list) -> int:
+    """
+    Применение недостающих миграций.
+    Для актуальной базы сводится к одному чтению PRAGMA user_version.
+
+    :return: версия схемы после миграции.
+    """
+    version = schema_version(conn)
+    if version >= len(migrations):
+        return version
+
+    while version < len(migrations):
+        cursor = begin_immediate(conn)
+        try:
+            # Версию перечитываем под блокировкой: базу мог уже обновить другой процесс
+            version = schema_version(conn)
+            if version < len(migrations):
+                migrations[version](cursor)
+                version += 1
+                cursor.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return version
+
+
+def ensure_schema(conn: sqlite3.Connection, migrations: list) -> None:
+    """
+    Проверка схемы один раз для каждого соединения: одно чтение PRAGMA user_version
+    (и миграция, если база отстала). Повторные вызовы с тем же соединением не обращаются к базе.
+    """
+    try:
+        checked = _ready.get(conn)
+    except TypeError:
+        # Обычный sqlite3.Connection не поддерживает weakref: проверяем каждый раз
+        migrate(conn, migrations)
+        return
+    if checked is not None and id(migrations) in checked:
+        return
+    migrate(conn, migrations)
+    with _ready_lock:
+        _ready.setdefault(conn, set()).add(id(migrations))
+
+
+def _shop_initial_schema(cursor: sqlite3.Cursor) -> None:
+    # IF NOT EXISTS: базы, созданные до появления миграций, имеют user_version = 0 и все таблицы
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE,  -- Добавлено UNIQUE constraint
+            price REAL NOT NULL,
+            quantity INTEGER NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            customer_name TEXT NOT NULL,
+            total_price REAL NOT NULL
+        )
+    ''')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS order_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            order_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER NOT NULL,
+            FOREIGN KEY (order_id) REFERENCES orders(id),
+            FOREIGN KEY (product_id) REFERENCES products(id)
+        )
+    ''')
+
+    # Покрывающие индексы для filter_products: порядок (поле сортировки, id) совпадает с порядком выдачи
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price, id, quantity, name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_quantity ON products (quantity, id, price, name)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_products_name ON products (name, id, price, quantity)")
+
+
+def _shop_order_items_indexes(cursor: sqlite3.Cursor) -> None:
+    # delete_order и delete_product удаляют строки order_items по order_id / product_id
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_order_items_product ON order_items (product_id)")
+
+
+def _shop_sessions_and_carts(cursor: sqlite3.Cursor) -> None:
+    # Сессии и сохранённые корзины (см. sessions.SessionStore); корзина принадлежит покупателю, а не сессии
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sessions (
+            token TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            role TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_seen REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_seen ON sessions (last_seen)")
+
+    # version увеличивается при каждой записи корзины: по нему процесс решает, нужно ли перечитать корзину
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS carts (
+            username TEXT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_carts_updated_at ON carts (updated_at)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cart_items (
+            username TEXT NOT NULL,
+            product_name TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            price REAL NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (username, product_name)
+        ) WITHOUT ROWID
+    ''')
+
+
+def _shop_sales_aggregates(cursor: sqlite3.Cursor) -> None:
+    # Агрегаты продаж (см. reporting); create_order / delete_order обновляют их в своей транзакции
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS product_sales (
+            product_id INTEGER PRIMARY KEY,
+            units INTEGER NOT NULL,
+            revenue REAL NOT NULL
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_units ON product_sales (units)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_product_sales_revenue ON product_sales (revenue)")
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS customer_sales (
+            customer_name TEXT PRIMARY KEY,
+            orders INTEGER NOT NULL,
+            revenue REAL NOT NULL
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_customer_sales_revenue ON customer_sales (revenue)")
+
+    # Заполнение по уже существующим заказам; цена строки заказа не хранится, берётся текущая цена товара
+    cursor.execute('''
+        INSERT INTO product_sales (product_id, units, revenue)
+        SELECT order_items.product_id, SUM(order_items.quantity), SUM(order_items.quantity * products.price)
+        FROM order_items JOIN products ON products.id = order_items.product_id
+        GROUP BY order_items.product_id
+    ''')
+    cursor.execute('''
+        INSERT INTO customer_sales (customer_name, orders, revenue)
+        SELECT customer_name, COUNT(*), SUM(total_price) FROM orders GROUP BY customer_name
+    ''')
+
+
+def _shop_order_line_snapshots(cursor: sqlite3.Cursor) -> None:
+    # Строка заказа хранит название и цену товара на момент покупки и не зависит от таблицы products
+    cursor.execute("ALTER TABLE order_items ADD COLUMN product_name TEXT")
+    cursor.execute("ALTER TABLE order_items ADD COLUMN unit_price REAL NOT NULL DEFAULT 0")
+    # Для старых заказов цена покупки неизвестна: берём текущую цену товара
+    cursor.execute('''
+        UPDATE order_items SET
+            product_name = (SELECT name FROM products WHERE products.id = order_items.product_id),
+            unit_price = COALESCE((SELECT price FROM products WHERE products.id = order_items.product_id), 0)
+    ''')
+
+
+def _shop_stock_reservations(cursor: sqlite3.Cursor) -> None:
+    # Удержания товара в корзинах (см. reservations): удержанное количество уже вычтено из products.quantity
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            holder TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (holder, product_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_stock_reservations_expires_at ON stock_reservations (expires_at)")
+
+
+def _shop_products_fts(cursor: sqlite3.Cursor) -> None:
+    cursor.execute("ALTER TABLE products ADD COLUMN description TEXT NOT NULL DEFAULT ''")
+
+    # Полнотекстовый индекс без копии данных (content='products'); prefix='2 3' ускоряет поиск по началу слова
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, description,
+            content='products', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )
+    ''')
+
+    # Индекс поддерживается триггерами; изменение цены и остатка его не затрагивает
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, description)
+            VALUES ('delete', old.id, old.name, old.description);
+            INSERT INTO products_fts (rowid, name, description) VALUES (new.id, new.name, new.description);
+        END
+    ''')
+    cursor.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+
+def _users_initial_schema(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL,
+            role TEXT NOT NULL
+        )
+    ''')
+
+
+def _users_unique_username(cursor: sqlite3.Cursor) -> None:
+    # Дубликаты имён не удаляем, а переименовываем в "<имя>#<id>": учётные записи сохраняются,
+    # вход под исходным именем остаётся у самой ранней из них
+    cursor.execute('''
+        UPDATE users SET username = username || '#' || id
+        WHERE id NOT IN (SELECT MIN(id) FROM users GROUP BY username)
+    ''')
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username ON users (username)")
+
+
+def _users_role_permissions(cursor: sqlite3.Cursor) -> None:
+    # Права ролей (см. permissions); набор по умолчанию повторяет пункты меню каждой роли
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS role_permissions (
+            role TEXT NOT NULL,
+            permission TEXT NOT NULL,
+            PRIMARY KEY (role, permission)
+        ) WITHOUT ROWID
+    ''')
+    defaults = {
+        "client": ("product.view", "order.create"),
+        "employee": ("product.view", "product.add", "product.update", "product.delete", "user.update_self"),
+        "admin": ("product.view", "order.delete", "user.view", "user.create", "user.update", "user.update_self",
+                  "user.delete", "reports.view"),
+    }
+    cursor.executemany("INSERT OR IGNORE INTO role_permissions (role, permission) VALUES (?, ?)",
+                       [(role, permission) for role, permissions in defaults.items() for permission in permissions])
+
+
+def _users_order_view_permissions(cursor: sqlite3.Cursor) -> None:
+    # Просмотр заказов: администратор видит все заказы, покупатель - только свои (чек после оформления)
+    cursor.executemany("INSERT OR IGNORE INTO role_permissions (role, permission) VALUES (?, ?)",
+                       [("admin", "order.view"), ("client", "order.view_self")])
+
+
+def _audit_initial_schema(cursor: sqlite3.Cursor) -> None:
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS audit_events (
+            id INTEGER PRIMARY KEY,
+            at REAL NOT NULL,
+            actor TEXT,
+            action TEXT NOT NULL,
+            entity TEXT NOT NULL,
+            entity_id TEXT,
+            details TEXT
+        )
+    ''')
+    # Индексы под AuditLog.query: по исполнителю, по объекту и по времени
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_events_actor ON audit_events (actor, at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_events_entity ON audit_events (entity, entity_id, at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_audit_events_at ON audit_events (at)")
+
+    # Журнал только дополняется: изменение и удаление событий запрещены
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS audit_events_no_update BEFORE UPDATE ON audit_events BEGIN
+            SELECT RAISE(ABORT, 'audit_events is append-only');
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS audit_events_no_delete BEFORE DELETE ON audit_events BEGIN
+            SELECT RAISE(ABORT, 'audit_events is append-only');
+        END
+    ''')
+
+
+SHOP_MIGRATIONS = [
+    _shop_initial_schema,
+    _shop_order_items_indexes,
+    _shop_sessions_and_carts,
+    _shop_sales_aggregates,
+    _shop_order_line_snapshots,
+    _shop_stock_reservations,
+    _shop_products_fts,
+]
+
+USER_MIGRATIONS = [
+    _users_initial_schema,
+    _users_unique_username,
+    _users_role_permissions,
+    _users_order_view_permissions,
+]
+
+AUDIT_MIGRATIONS = [
+    _audit_initial_schema,
+]
@@ -0,0 +1,166 @@
+"""
+Хеширование паролей (PBKDF2-HMAC-SHA256) для UserAuthentication.
+
+Хеш хранится в виде строки "pbkdf2_sha256$<итерации>$<соль>$<хеш>" (соль и хеш в base64),
+поэтому стоимость хеширования можно менять без миграции базы: старые хеши
+пересчитываются при следующем успешном входе.
+"""
+import base64
+import hashlib
+import hmac
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+ALGORITHM = "pbkdf2_sha256"
+DEFAULT_ITERATIONS = 200_000
+SALT_SIZE = 16
+
+
+def hash_password(password: str, iterations: int = DEFAULT_ITERATIONS) -> str:
+    """
+    Вычисление хеша пароля со случайной солью.
+
+    :return: строка вида "pbkdf2_sha256$<итерации>$<соль>$<хеш>".
+    """
+    salt = os.urandom(SALT_SIZE)
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, iterations)
+    return "$".join((ALGORITHM, str(iterations),
+                     base64.b64encode(salt).decode("ascii"), base64.b64encode(digest).decode("ascii")))
+
+
+def is_password_hash(stored: str) -> bool:
+    """
+    Проверка, что значение из столбца password - хеш, а не пароль в открытом виде из старых версий.
+    """
+    return stored.startswith(ALGORITHM + "$") and stored.count("$") == 3
+
+
+def verify_password(password: str, stored: str) -> bool:
+    """
+    Сравнение пароля с сохранённым хешем (или, для старых записей, с открытым паролем) за постоянное время.
+    """
+    if not is_password_hash(stored):
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    _, iterations, salt, expected = stored.split("$")
+    digest = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), base64.b64decode(salt), int(iterations))
+    return hmac.compare_digest(digest, base64.b64decode(expected))
+
+
+def needs_rehash(stored: str, iterations: int = DEFAULT_ITERATIONS) -> bool:
+    """
+    Нужно ли пересчитать хеш: пароль хранится открыто или с другим числом итераций.
+    """
+    return not is_password_hash(stored) or int(stored.split("$")[1]) != iterations
+
+
+def benchmark_iterations(target_seconds: float = 0.1, probe_iterations: int = 50_000) -> dict:
+    """
+    Замер скорости PBKDF2 на текущей машине и подбор числа итераций под целевое время одного хеширования.
+
+    :return: словарь с замером и рекомендуемым числом итераций.
+    """
+    salt = os.urandom(SALT_SIZE)
+    started = time.perf_counter()
+    hashlib.pbkdf2_hmac("sha256", b"benchmark", salt, probe_iterations)
+    elapsed = time.perf_counter() - started
+    per_second = probe_iterations / elapsed
+    return {
+        "probe_iterations": probe_iterations,
+        "probe_seconds": elapsed,
+        "iterations_per_second": int(per_second),
+        "target_seconds": target_seconds,
+        "recommended_iterations": int(per_second * target_seconds),
+    }
+
+
+class PasswordHasher:
+    def __init__(self, iterations: int = DEFAULT_ITERATIONS, workers: int = 4,
+                 cache_size: int = 1024, cache_ttl: float = 300.0) -> None:
+        """
+        Инициализация хешировщика.
+
+        :param iterations: число итераций PBKDF2 (стоимость хеширования).
+        :param workers: число потоков, в которых считаются хеши; ограничивает нагрузку на процессор.
+        :param cache_size: максимальное число запомненных успешных проверок.
+        :param cache_ttl: сколько секунд успешная проверка остаётся в кэше.
+        """
+        self.iterations = iterations
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # hashlib.pbkdf2_hmac отпускает GIL, поэтому потоки пула считают хеши параллельно
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hasher")
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hash_async(self, password: str):
+        """
+        Хеширование пароля в пуле потоков.
+
+        :return: Future со строкой хеша.
+        """
+        return self._executor.submit(hash_password, password, self.iterations)
+
+    def hash(self, password: str) -> str:
+        return self.hash_async(password).result()
+
+    def verify_async(self, username: str, password: str, stored: str):
+        """
+        Проверка пароля в пуле потоков; недавние успешные проверки берутся из кэша.
+
+        :return: Future с результатом проверки.
+        """
+        key = self._cache_key(username, password, stored)
+        with self._lock:
+            expires = self._cache.get(key)
+            if expires is not None and expires > time.monotonic():
+                self._cache.move_to_end(key)
+                future = Future()
+                future.set_result(True)
+                return future
+            self._cache.pop(key, None)
+        future = self._executor.submit(verify_password, password, stored)
+        future.add_done_callback(lambda done: self._remember(key) if done.result() else None)
+        return future
+
+    def verify(self, username: str, password: str, stored: str) -> bool:
+        return self.verify_async(username, password, stored).result()
+
+    def needs_rehash(self, stored: str) -> bool:
+        return needs_rehash(stored, self.iterations)
+
+    def forget(self, username: str) -> None:
+        """
+        Удаление из кэша всех проверок пользователя (например, после смены пароля).
+        """
+        with self._lock:
+            for key in [key for key in self._cache if key[0] == username]:
+                del self._cache[key]
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True)
+
+    @staticmethod
+    def _cache_key(username: str, password: str, stored: str) -> tuple:
+        # В ключ входит сохранённый хеш: после смены пароля старые записи кэша перестают совпадать
+        digest = hashlib.sha256(f"{password}\0{stored}".encode("utf-8")).digest()
+        return username, digest
+
+    def _remember(self, key: tuple) -> None:
+        with self._lock:
+            self._cache[key] = time.monotonic() + self.cache_ttl
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+if __name__ == "__main__":
+    result = benchmark_iterations()
+    print(f"PBKDF2-SHA256: {result['iterations_per_second']} итераций/с; "
+          f"для {result['target_seconds']} с на хеш рекомендуется {result['recommended_iterations']} итераций.")
+    for iterations in (50_000, 100_000, DEFAULT_ITERATIONS, 400_000):
+        started = time.perf_counter()
+        hash_password("benchmark", iterations)
+        print(f"{iterations:>8} итераций: {(time.perf_counter() - started) * 1000:.1f} мс")
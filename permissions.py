@@ -0,0 +1,191 @@
+"""
+Права ролей и их проверка в методах JewelryShop и UserAuthentication.
+
+Права ролей хранятся в таблице role_permissions базы пользователей. UserAuthentication.login()
+возвращает сессию (Session); пока сессия активна (with session: ... или session.activate()),
+методы, помеченные @requires, проверяют её права. Набор прав роли читается из базы один раз
+и кэшируется, поэтому проверка сводится к поиску в frozenset. Кэш сбрасывается при изменении
+роли пользователя (update_user) и прав ролей (grant / revoke).
+
+Проверки включаются только для объектов, подключённых через Authorizer.protect(): без него
+методы работают как раньше.
+"""
+import contextvars
+import functools
+import threading
+
+PRODUCT_VIEW = "product.view"
+PRODUCT_ADD = "product.add"
+PRODUCT_UPDATE = "product.update"
+PRODUCT_DELETE = "product.delete"
+ORDER_CREATE = "order.create"
+ORDER_DELETE = "order.delete"
+ORDER_VIEW = "order.view"
+ORDER_VIEW_SELF = "order.view_self"
+USER_VIEW = "user.view"
+USER_CREATE = "user.create"
+USER_UPDATE = "user.update"
+USER_UPDATE_SELF = "user.update_self"
+USER_DELETE = "user.delete"
+REPORTS_VIEW = "reports.view"
+
+# Сессия, от имени которой выполняются вызовы в текущем потоке (или задаче asyncio)
+current_session = contextvars.ContextVar("current_session", default=None)
+
+
+class PermissionDenied(PermissionError):
+    """
+    У текущей сессии нет нужного права (или сессии нет, а проверки включены).
+    """
+
+
+class Session:
+    __slots__ = ("user_id", "username", "_authorizer", "_role", "_permissions", "_generation", "_tokens")
+
+    def __init__(self, authorizer: "Authorizer", user_id: int, username: str, role: str) -> None:
+        """
+        Сессия вошедшего пользователя. Права роли кэшируются в сессии и перечитываются,
+        только если Authorizer сбросил кэш (изменилась роль пользователя или права ролей).
+        """
+        self.user_id = user_id
+        self.username = username
+        self._authorizer = authorizer
+        self._role = role
+        self._permissions = authorizer.role_permissions(role)
+        self._generation = authorizer.generation
+        self._tokens = []
+
+    def _refresh(self) -> None:
+        if self._generation != self._authorizer.generation:
+            self._generation = self._authorizer.generation
+            self._role = self._authorizer.user_role(self.user_id)
+            self._permissions = self._authorizer.role_permissions(self._role)
+
+    @property
+    def role(self) -> str:
+        """
+        Текущая роль пользователя; None, если пользователь удалён.
+        """
+        self._refresh()
+        return self._role
+
+    @property
+    def permissions(self) -> frozenset:
+        self._refresh()
+        return self._permissions
+
+    def can(self, permission: str) -> bool:
+        return permission in self.permissions
+
+    def activate(self) -> None:
+        """
+        Выполнение последующих вызовов в текущем потоке от имени этой сессии (до deactivate()).
+        """
+        self._tokens.append(current_session.set(self))
+
+    def deactivate(self) -> None:
+        current_session.reset(self._tokens.pop())
+
+    def __enter__(self):
+        self.activate()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.deactivate()
+
+
+class Authorizer:
+    def __init__(self, user_auth) -> None:
+        """
+        :param user_auth: UserAuthentication, в базе которого хранятся пользователи и права ролей.
+        """
+        self.user_auth = user_auth
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._roles = {}  # роль -> frozenset прав
+
+    def protect(self, *services) -> "Authorizer":
+        """
+        Включение проверки прав для JewelryShop / UserAuthentication.
+        """
+        for service in services:
+            service.authorizer = self
+        return self
+
+    def session(self, user_id: int, username: str, role: str) -> Session:
+        return Session(self, user_id, username, role)
+
+    def role_permissions(self, role: str) -> frozenset:
+        """
+        Права роли (из кэша; при промахе - один запрос к базе).
+        """
+        permissions = self._roles.get(role)
+        if permissions is None:
+            generation = self.generation
+            cursor = self.user_auth.conn.cursor()
+            cursor.execute("SELECT permission FROM role_permissions WHERE role=?", (role,))
+            permissions = frozenset(row[0] for row in cursor.fetchall())
+            with self._lock:
+                # Сброс кэша во время чтения: результат мог устареть, не сохраняем его
+                if generation == self.generation:
+                    self._roles[role] = permissions
+        return permissions
+
+    def user_role(self, user_id: int):
+        cursor = self.user_auth.conn.cursor()
+        cursor.execute("SELECT role FROM users WHERE id=?", (user_id,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    def invalidate(self) -> None:
+        """
+        Сброс кэша прав; активные сессии перечитают свою роль и права при следующей проверке.
+        """
+        with self._lock:
+            self.generation += 1
+            self._roles = {}
+
+    def grant(self, role: str, permission: str) -> None:
+        conn = self.user_auth.conn
+        conn.execute("INSERT OR IGNORE INTO role_permissions (role, permission) VALUES (?, ?)", (role, permission))
+        conn.commit()
+        self.invalidate()
+
+    def revoke(self, role: str, permission: str) -> None:
+        conn = self.user_auth.conn
+        conn.execute("DELETE FROM role_permissions WHERE role=? AND permission=?", (role, permission))
+        conn.commit()
+        self.invalidate()
+
+
+def require(service, *permissions: str) -> Session:
+    """
+    Проверка, что у текущей сессии есть хотя бы одно из прав permissions.
+    Если для service проверки не включены (authorizer не задан), ничего не проверяет.
+
+    :return: текущая сессия (None, если проверки не включены и сессии нет).
+    :raises PermissionDenied: права нет или нет активной сессии.
+    """
+    session = current_session.get()
+    if getattr(service, "authorizer", None) is None:
+        return session
+    if session is None:
+        raise PermissionDenied(f"Требуется вход в систему (право {' / '.join(permissions)}).")
+    granted = session.permissions
+    if not any(permission in granted for permission in permissions):
+        raise PermissionDenied(f"У пользователя '{session.username}' нет права {' / '.join(permissions)}.")
+    return session
+
+
+def requires(*permissions: str):
+    """
+    Декоратор метода JewelryShop / UserAuthentication: вызов разрешён, если у текущей сессии
+    есть хотя бы одно из прав permissions (см. require).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            require(self, *permissions)
+            return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
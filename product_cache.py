@@ -0,0 +1,120 @@
+"""
+Кэш товаров в памяти процесса для JewelryShop.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class ProductCache:
+    def __init__(self, max_size: int = 10000, ttl: float = 60.0, snapshot_limit: int = 10000) -> None:
+        """
+        Инициализация кэша.
+
+        :param max_size: максимальное число товаров в кэше; при переполнении вытесняется давно не использованный.
+        :param ttl: время жизни записи в секундах (ограничивает устаревание, если базу меняет другой процесс).
+        :param snapshot_limit: максимальное число строк в кэшированном списке доступных товаров.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.snapshot_limit = snapshot_limit
+        self._lock = threading.Lock()
+        self._products = OrderedDict()
+        self._available = None
+        self._available_expires = 0.0
+        # Поколение увеличивается при каждой инвалидации: значения, прочитанные из базы до неё, не кэшируются
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, name: str):
+        """
+        Получение товара из кэша.
+
+        :return: кортеж (id, price, quantity) или None, если записи нет или она устарела.
+        """
+        with self._lock:
+            entry = self._products.get(name)
+            if entry is not None:
+                value, expires = entry
+                if expires > time.monotonic():
+                    self._products.move_to_end(name)
+                    self.hits += 1
+                    return value
+                del self._products[name]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put(self, name: str, value: tuple, generation: int) -> None:
+        """
+        Сохранение товара, прочитанного из базы при поколении generation.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._products[name] = (value, time.monotonic() + self.ttl)
+            self._products.move_to_end(name)
+            while len(self._products) > self.max_size:
+                self._products.popitem(last=False)
+                self.evictions += 1
+
+    def get_available(self):
+        """
+        Кэшированный список доступных товаров или None.
+        """
+        with self._lock:
+            if self._available is not None and self._available_expires > time.monotonic():
+                self.hits += 1
+                return self._available
+            if self._available is not None:
+                self._available = None
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def put_available(self, rows: list, generation: int) -> None:
+        """
+        Сохранение списка доступных товаров, прочитанного из базы при поколении generation.
+        """
+        with self._lock:
+            if generation == self._generation and len(rows) <= self.snapshot_limit:
+                self._available = rows
+                self._available_expires = time.monotonic() + self.ttl
+
+    def invalidate(self, names=()) -> None:
+        """
+        Удаление из кэша указанных товаров и списка доступных товаров.
+        """
+        with self._lock:
+            self._generation += 1
+            self._available = None
+            for name in names:
+                self._products.pop(name, None)
+
+    def clear(self) -> None:
+        """
+        Полная очистка кэша.
+        """
+        with self._lock:
+            self._generation += 1
+            self._available = None
+            self._products.clear()
+
+    def stats(self) -> dict:
+        """
+        Счётчики попаданий, промахов и вытеснений для подбора размера кэша.
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._products),
+                "snapshot_cached": self._available is not None,
+            }
@@ -0,0 +1,154 @@
+"""
+Отчёты о продажах по заранее посчитанным агрегатам.
+
+Таблицы product_sales (штуки и выручка по товару) и customer_sales (число заказов и
+выручка по покупателю) обновляются JewelryShop.create_order / delete_order в той же
+транзакции, что и сами заказы, поэтому отчёты читают небольшие сводные таблицы, а не
+всю историю order_items. rebuild() пересчитывает агрегаты с нуля.
+
+Продажи удалённых товаров остаются в отчётах: их название берётся из строк заказов.
+"""
+import sqlite3
+
+from database import begin_immediate
+from permissions import REPORTS_VIEW, requires
+
+_REPORT_ORDER = {"units": "units", "revenue": "revenue"}
+# Название товара из каталога, а для удалённого товара - из последней строки заказа с ним
+_PRODUCT_NAME = '''COALESCE(products.name, (
+    SELECT order_items.product_name FROM order_items WHERE order_items.product_id = product_sales.product_id
+    ORDER BY order_items.id DESC LIMIT 1))'''
+
+
+def record_sales(cursor: sqlite3.Cursor, product_sales: dict, customer_sales: dict) -> None:
+    """
+    Добавление продаж к агрегатам; вызывается внутри транзакции заказа.
+
+    :param product_sales: {id товара: (штук, выручка)}.
+    :param customer_sales: {имя покупателя: (заказов, выручка)}.
+    Для отмены заказа передаются отрицательные значения; строки, опустившиеся до нуля, удаляются.
+    """
+    cursor.executemany('''
+        INSERT INTO product_sales (product_id, units, revenue) VALUES (?, ?, ?)
+        ON CONFLICT(product_id) DO UPDATE SET units = units + excluded.units, revenue = revenue + excluded.revenue
+    ''', [(product_id, units, revenue) for product_id, (units, revenue) in product_sales.items()])
+    cursor.executemany('''
+        INSERT INTO customer_sales (customer_name, orders, revenue) VALUES (?, ?, ?)
+        ON CONFLICT(customer_name) DO UPDATE SET orders = orders + excluded.orders,
+                                                 revenue = revenue + excluded.revenue
+    ''', [(customer_name, orders, revenue) for customer_name, (orders, revenue) in customer_sales.items()])
+
+    cursor.executemany("DELETE FROM product_sales WHERE product_id = ? AND units <= 0",
+                       [(product_id,) for product_id, (units, _) in product_sales.items() if units < 0])
+    cursor.executemany("DELETE FROM customer_sales WHERE customer_name = ? AND orders <= 0",
+                       [(customer_name,) for customer_name, (orders, _) in customer_sales.items() if orders < 0])
+
+
+class SalesReport:
+    def __init__(self, shop) -> None:
+        """
+        :param shop: JewelryShop, по базе которого строятся отчёты.
+        """
+        self.shop = shop
+
+    @property
+    def authorizer(self):
+        # Отчёты проверяют права так же, как магазин, по которому они строятся
+        return self.shop.authorizer
+
+    @requires(REPORTS_VIEW)
+    def totals(self) -> dict:
+        """
+        Итоги по всем заказам: число заказов, проданных штук и выручка.
+        """
+        cursor = self.shop.conn.cursor()
+        cursor.execute("SELECT COALESCE(SUM(orders), 0), COALESCE(SUM(revenue), 0) FROM customer_sales")
+        orders, revenue = cursor.fetchone()
+        cursor.execute("SELECT COALESCE(SUM(units), 0) FROM product_sales")
+        return {"orders": orders, "units": cursor.fetchone()[0], "revenue": revenue}
+
+    @requires(REPORTS_VIEW)
+    def product_sales(self, product_name: str):
+        """
+        Продажи товара.
+
+        :return: кортеж (штук, выручка) или None, если товар не продавался.
+        """
+        cursor = self.shop.conn.cursor()
+        # Товар ищется сначала в каталоге, затем (если он удалён) среди строк заказов
+        cursor.execute('''
+            SELECT units, revenue FROM product_sales
+            WHERE product_id = COALESCE((SELECT id FROM products WHERE name = ?),
+                                        (SELECT product_id FROM order_items WHERE product_name = ?
+                                         ORDER BY id DESC LIMIT 1))
+        ''', (product_name, product_name))
+        return cursor.fetchone()
+
+    @requires(REPORTS_VIEW)
+    def customer_sales(self, customer_name: str):
+        """
+        Продажи покупателю.
+
+        :return: кортеж (заказов, выручка) или None, если покупатель ничего не заказывал.
+        """
+        cursor = self.shop.conn.cursor()
+        cursor.execute("SELECT orders, revenue FROM customer_sales WHERE customer_name = ?", (customer_name,))
+        return cursor.fetchone()
+
+    @requires(REPORTS_VIEW)
+    def top_products(self, limit: int = 10, by: str = "revenue") -> list:
+        """
+        Самые продаваемые товары.
+
+        :param by: "revenue" - по выручке, "units" - по числу проданных штук.
+        :return: список кортежей (название, штук, выручка).
+        """
+        if by not in _REPORT_ORDER:
+            raise ValueError(f"Недопустимое поле сортировки: {by!r}.")
+        cursor = self.shop.conn.cursor()
+        # Обход индекса по units / revenue с конца: читаются только limit строк
+        cursor.execute(f'''
+            SELECT {_PRODUCT_NAME}, product_sales.units, product_sales.revenue
+            FROM product_sales LEFT JOIN products ON products.id = product_sales.product_id
+            ORDER BY product_sales.{_REPORT_ORDER[by]} DESC
+            LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
+
+    @requires(REPORTS_VIEW)
+    def top_customers(self, limit: int = 10) -> list:
+        """
+        Покупатели с наибольшей выручкой.
+
+        :return: список кортежей (имя, заказов, выручка).
+        """
+        cursor = self.shop.conn.cursor()
+        cursor.execute("SELECT customer_name, orders, revenue FROM customer_sales ORDER BY revenue DESC LIMIT ?",
+                       (limit,))
+        return cursor.fetchall()
+
+    @requires(REPORTS_VIEW)
+    def rebuild(self) -> dict:
+        """
+        Пересчёт агрегатов по всей истории заказов в одной транзакции.
+
+        :return: итоги после пересчёта (см. totals).
+        """
+        conn = self.shop.conn
+        cursor = begin_immediate(conn)
+        try:
+            cursor.execute("DELETE FROM product_sales")
+            cursor.execute("DELETE FROM customer_sales")
+            cursor.execute('''
+                INSERT INTO product_sales (product_id, units, revenue)
+                SELECT product_id, SUM(quantity), SUM(quantity * unit_price) FROM order_items GROUP BY product_id
+            ''')
+            cursor.execute('''
+                INSERT INTO customer_sales (customer_name, orders, revenue)
+                SELECT customer_name, COUNT(*), SUM(total_price) FROM orders GROUP BY customer_name
+            ''')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return self.totals()
@@ -0,0 +1,307 @@
+"""
+Удержание товара в корзинах и защита от перепродажи при параллельном оформлении заказов.
+
+Удержание сразу вычитает товар из products.quantity условным UPDATE
+(quantity = quantity - ? WHERE id = ? AND quantity >= ?) в транзакции BEGIN IMMEDIATE
+и записывает его в stock_reservations со сроком действия. Истёкшие удержания
+возвращаются на склад одним запросом (expire). При оформлении заказа удержания
+покупателя возвращаются на склад в той же транзакции, в которой заказ списывает
+остатки (JewelryShop.create_order(..., holder=...)), поэтому удержанный товар
+не может достаться никому другому.
+
+Запуск модуля - проверка отсутствия перепродажи под нагрузкой (см. stress_test):
+    python reservations.py --threads 32 --checkouts 200
+"""
+import sqlite3
+import threading
+import time
+
+from database import begin_immediate
+from permissions import ORDER_CREATE, requires
+
+DEFAULT_HOLD_SECONDS = 900.0
+
+
+def is_busy_error(error: Exception) -> bool:
+    """
+    Ошибка SQLITE_BUSY / SQLITE_LOCKED: блокировку базы не удалось получить за busy_timeout.
+    """
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def retry_on_busy(operation, *args, attempts: int = 5, base_delay: float = 0.01, **kwargs):
+    """
+    Вызов operation(*args, **kwargs) с повтором при занятой базе.
+    Перед каждым повтором пауза растёт вдвое (со случайной добавкой, чтобы повторы не совпадали).
+    """
+    for attempt in range(attempts):
+        try:
+            return operation(*args, **kwargs)
+        except sqlite3.OperationalError as e:
+            if not is_busy_error(e) or attempt == attempts - 1:
+                raise
+            import random
+            time.sleep(base_delay * 2 ** attempt * (1 + random.random()))
+
+
+def release_holds(cursor: sqlite3.Cursor, holders) -> list:
+    """
+    Возврат всех удержаний указанных держателей на склад; вызывается внутри уже открытой транзакции.
+
+    :return: названия товаров, остаток которых изменился.
+    """
+    holders = list(holders)
+    if not holders:
+        return []
+    placeholders = ", ".join("?" * len(holders))
+    cursor.execute(f'''
+        SELECT products.name FROM stock_reservations JOIN products ON products.id = stock_reservations.product_id
+        WHERE stock_reservations.holder IN ({placeholders})
+    ''', holders)
+    names = [row[0] for row in cursor.fetchall()]
+    cursor.execute(f'''
+        UPDATE products SET quantity = quantity + (
+            SELECT SUM(quantity) FROM stock_reservations
+            WHERE stock_reservations.product_id = products.id AND holder IN ({placeholders}))
+        WHERE id IN (SELECT product_id FROM stock_reservations WHERE holder IN ({placeholders}))
+    ''', holders + holders)
+    cursor.execute(f"DELETE FROM stock_reservations WHERE holder IN ({placeholders})", holders)
+    return names
+
+
+class StockReservations:
+    def __init__(self, shop, hold_seconds: float = DEFAULT_HOLD_SECONDS) -> None:
+        """
+        :param shop: JewelryShop, остатки которого удерживаются.
+        :param hold_seconds: срок удержания; продлевается при каждом изменении удержаний держателя.
+        """
+        self.shop = shop
+        self.hold_seconds = hold_seconds
+
+    @property
+    def authorizer(self):
+        # Удерживать товар может тот, кто может оформить заказ (права проверяются, если включены у магазина)
+        return self.shop.authorizer
+
+    @requires(ORDER_CREATE)
+    def hold(self, holder: str, quantities: dict, replace: bool = False) -> list:
+        """
+        Установка удерживаемого количества товаров (все изменения - в одной транзакции, всё или ничего).
+
+        :param holder: держатель удержаний (имя покупателя).
+        :param quantities: {id товара: сколько должно быть удержано}; 0 снимает удержание.
+        :param replace: снять удержания товаров, которых нет в quantities.
+        :return: id товаров, которых не хватило на складе; если список не пуст, ничего не изменено.
+        """
+        # Транзакция при ошибке откатывается целиком, поэтому её можно повторить
+        return retry_on_busy(self._hold, holder, quantities, replace)
+
+    def _hold(self, holder: str, quantities: dict, replace: bool) -> list:
+        conn = self.shop.conn
+        cursor = begin_immediate(conn)
+        try:
+            cursor.execute("SELECT product_id, quantity FROM stock_reservations WHERE holder = ?", (holder,))
+            held = dict(cursor.fetchall())
+            wanted = dict.fromkeys(held, 0) if replace else {}
+            wanted.update(quantities)
+
+            missing = []
+            changed_ids = []
+            for product_id, quantity in wanted.items():
+                delta = quantity - held.get(product_id, 0)
+                if delta > 0:
+                    cursor.execute("UPDATE products SET quantity = quantity - ? WHERE id = ? AND quantity >= ?",
+                                   (delta, product_id, delta))
+                    if cursor.rowcount != 1:
+                        missing.append(product_id)
+                        continue
+                elif delta < 0:
+                    cursor.execute("UPDATE products SET quantity = quantity + ? WHERE id = ?", (-delta, product_id))
+                else:
+                    continue
+                changed_ids.append(product_id)
+            if missing:
+                conn.rollback()
+                return missing
+
+            expires_at = time.time() + self.hold_seconds
+            cursor.executemany("DELETE FROM stock_reservations WHERE holder = ? AND product_id = ?",
+                               [(holder, product_id) for product_id, quantity in wanted.items() if quantity <= 0])
+            cursor.executemany('''
+                INSERT INTO stock_reservations (holder, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(holder, product_id) DO UPDATE SET quantity = excluded.quantity
+            ''', [(holder, product_id, quantity, expires_at)
+                  for product_id, quantity in wanted.items() if quantity > 0])
+            cursor.execute("UPDATE stock_reservations SET expires_at = ? WHERE holder = ?", (expires_at, holder))
+            cursor.execute(f"SELECT name FROM products WHERE id IN ({', '.join('?' * len(changed_ids))})",
+                           changed_ids)
+            names = [row[0] for row in cursor.fetchall()]
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.shop.product_cache.invalidate(names)
+        return []
+
+    def hold_cart(self, holder: str, cart) -> list:
+        """
+        Удержание ровно того, что лежит в корзине (Cart); удержания других товаров снимаются.
+
+        :return: см. hold.
+        """
+        quantities = {}
+        for line in cart.items.values():
+            quantities[line.product_id] = quantities.get(line.product_id, 0) + line.quantity
+        return self.hold(holder, quantities, replace=True)
+
+    def get_holds(self, holder: str) -> dict:
+        """
+        :return: {id товара: удерживаемое количество}.
+        """
+        cursor = self.shop.conn.cursor()
+        cursor.execute("SELECT product_id, quantity FROM stock_reservations WHERE holder = ?", (holder,))
+        return dict(cursor.fetchall())
+
+    @requires(ORDER_CREATE)
+    def release(self, holder: str) -> None:
+        """
+        Возврат всех удержаний держателя на склад.
+        """
+        self._write(lambda cursor: (release_holds(cursor, (holder,)), None))
+
+    def expire(self, now: float = None) -> int:
+        """
+        Возврат на склад всех истёкших удержаний одним запросом.
+
+        :return: число снятых удержаний.
+        """
+        now = time.time() if now is None else now
+
+        def expire_holds(cursor):
+            cursor.execute('''
+                SELECT products.name FROM stock_reservations
+                JOIN products ON products.id = stock_reservations.product_id
+                WHERE stock_reservations.expires_at < ?
+            ''', (now,))
+            names = [row[0] for row in cursor.fetchall()]
+            cursor.execute('''
+                UPDATE products SET quantity = quantity + (
+                    SELECT SUM(quantity) FROM stock_reservations
+                    WHERE stock_reservations.product_id = products.id AND expires_at < ?)
+                WHERE id IN (SELECT product_id FROM stock_reservations WHERE expires_at < ?)
+            ''', (now, now))
+            cursor.execute("DELETE FROM stock_reservations WHERE expires_at < ?", (now,))
+            return names, cursor.rowcount
+
+        return self._write(expire_holds)
+
+    def _write(self, change):
+        # change(cursor) -> (названия изменённых товаров, результат); выполняется в транзакции BEGIN IMMEDIATE,
+        # которая повторяется, если база занята
+        return retry_on_busy(self._write_once, change)
+
+    def _write_once(self, change):
+        conn = self.shop.conn
+        cursor = begin_immediate(conn)
+        try:
+            names, result = change(cursor)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        self.shop.product_cache.invalidate(names)
+        return result
+
+
+def stress_test(threads: int = 16, checkouts: int = 100, products: int = 5, stock: int = 50,
+                max_quantity: int = 3, database_path: str = None) -> dict:
+    """
+    Проверка отсутствия перепродажи: threads потоков одновременно оформляют по checkouts заказов
+    на заведомо недостаточный запас товара. Половина заказов оформляется через удержание корзины.
+
+    :return: сводка; "oversold" - сколько единиц продано сверх начального запаса (должно быть 0).
+    :raises AssertionError: если остатки, удержания и проданное количество не сходятся.
+    """
+    import os
+    import random
+    import tempfile
+
+    from Python4 import Cart, JewelryShop
+
+    directory = None
+    if database_path is None:
+        directory = tempfile.TemporaryDirectory()
+        database_path = os.path.join(directory.name, "stress.db")
+    shop = JewelryShop(database_path)
+    reservations = StockReservations(shop)
+    names = [f"STRESS-{i}" for i in range(products)]
+    shop.bulk_upsert_products((name, 10.0, stock) for name in names)
+    start = threading.Barrier(threads)
+    errors = []
+    counters = {"orders": 0, "rejected": 0, "held": 0, "hold_refused": 0}
+    counters_lock = threading.Lock()
+
+    def worker(number: int) -> None:
+        rng = random.Random(number)
+        customer = f"stress-customer-{number}"
+        start.wait()
+        for i in range(checkouts):
+            cart = Cart(shop)
+            for name in rng.sample(names, rng.randint(1, len(names))):
+                cart.add_item(name, rng.randint(1, max_quantity))
+            try:
+                holder = None
+                if i % 2:
+                    if retry_on_busy(reservations.hold_cart, customer, cart):
+                        with counters_lock:
+                            counters["hold_refused"] += 1
+                    else:
+                        holder = customer
+                        with counters_lock:
+                            counters["held"] += 1
+                order_id, _ = retry_on_busy(shop.create_order, customer, cart, holder=holder)
+                with counters_lock:
+                    counters["orders" if order_id is not None else "rejected"] += 1
+            except Exception as e:
+                errors.append(repr(e))
+
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    cursor = shop.conn.cursor()
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0), MIN(quantity) FROM products WHERE name LIKE 'STRESS-%'")
+    remaining, min_remaining = cursor.fetchone()
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_reservations")
+    held = cursor.fetchone()[0]
+    cursor.execute("SELECT COALESCE(SUM(quantity), 0) FROM order_items")
+    sold = cursor.fetchone()[0]
+    shop.pool.close_all()
+    if directory is not None:
+        directory.cleanup()
+
+    initial = products * stock
+    result = dict(counters, threads=threads, seconds=elapsed, initial_stock=initial, sold=sold,
+                  remaining=remaining, still_held=held, oversold=max(sold - initial, 0), errors=errors)
+    assert not errors, errors
+    assert min_remaining >= 0, result
+    assert sold + remaining + held == initial, result
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Проверка отсутствия перепродажи при параллельном оформлении заказов.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--checkouts", type=int, default=100, help="заказов на поток")
+    parser.add_argument("--products", type=int, default=5)
+    parser.add_argument("--stock", type=int, default=50, help="начальный запас каждого товара")
+    args = parser.parse_args()
+    print(json.dumps(stress_test(args.threads, args.checkouts, args.products, args.stock), indent=2))
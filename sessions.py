@@ -0,0 +1,356 @@
+"""
+Сессии пользователей и сохранённые корзины с буфером записи в памяти.
+
+Изменения корзин накапливаются в памяти и записываются в базу магазина одной транзакцией -
+периодически (фоновым потоком или при очередном изменении) и при оформлении заказа.
+Корзина принадлежит покупателю, поэтому её видят все его сессии и все процессы,
+работающие с той же базой; процесс перечитывает корзину, только если её версия в базе
+изменилась (одно чтение по первичному ключу). Запись корзины проверяет версию: если корзину
+тем временем записал другой процесс, изменения этого процесса накладываются на её строки из
+базы, а не затирают их. Истёкшие сессии удаляются одним запросом при каждой периодической записи.
+"""
+import secrets
+import threading
+import time
+
+from database import begin_immediate
+from reservations import retry_on_busy
+
+
+def _cart_lines(cart) -> dict:
+    # {название: (id товара, цена, количество)}
+    return {name: (line.product_id, line.price, line.quantity) for name, line in cart.items.items()}
+
+
+def _merge_lines(base: dict, local: dict, stored: dict) -> dict:
+    """
+    Трёхстороннее слияние корзины: к строкам stored добавляется разница local - base
+    (что изменил этот процесс с момента чтения base).
+    """
+    merged = {}
+    for name in stored.keys() | local.keys() | base.keys():
+        quantity = (stored[name][2] if name in stored else 0) + \
+                   (local[name][2] if name in local else 0) - (base[name][2] if name in base else 0)
+        if quantity > 0:
+            product_id, price, _ = local[name] if name in local else stored[name]
+            merged[name] = (product_id, price, quantity)
+    return merged
+
+
+def _set_lines(cart, lines: dict) -> None:
+    cart.clear_cart()
+    for name, (product_id, price, quantity) in lines.items():
+        cart.restore_line(name, product_id, price, quantity)
+
+
+class SessionStore:
+    def __init__(self, shop, flush_interval: float = 5.0, session_ttl: float = 1800.0,
+                 background_flush: bool = False, cart_class=None, reservations=None) -> None:
+        """
+        Инициализация хранилища.
+
+        :param shop: магазин, в базе которого хранятся сессии и корзины.
+        :param flush_interval: как часто (в секундах) записывать накопленные изменения.
+        :param session_ttl: через сколько секунд бездействия сессия считается истёкшей.
+        :param background_flush: записывать изменения фоновым потоком, а не только при очередном вызове.
+        :param cart_class: класс корзины; по умолчанию Python4.Cart.
+        :param reservations: reservations.StockReservations; если задано, содержимое корзины удерживается на складе.
+        """
+        if cart_class is None:
+            from Python4 import Cart as cart_class
+        self.shop = shop
+        self.cart_class = cart_class
+        self.reservations = reservations
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl
+        self._lock = threading.RLock()
+        self._sessions = {}       # token -> ((username, role), время последнего обращения)
+        self._touched = {}        # token -> время последнего обращения, ещё не записанное в базу
+        self._carts = {}          # username -> [версия в базе, Cart, строки корзины в этой версии]
+        self._dirty = set()       # покупатели с незаписанными изменениями корзины
+        self._rehold = set()      # покупатели, чьи корзины слиты при записи и ещё не удержаны целиком
+        self._last_flush = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = None
+        if background_flush:
+            self._thread = threading.Thread(target=self._flush_loop, name="session-flush", daemon=True)
+            self._thread.start()
+
+    # Сессии
+
+    def create_session(self, username: str, role: str) -> str:
+        """
+        Создание сессии после успешного входа.
+
+        :return: токен сессии.
+        """
+        token = secrets.token_urlsafe(24)
+        now = time.time()
+        conn = self.shop.conn
+        conn.execute("INSERT INTO sessions (token, username, role, created_at, last_seen) VALUES (?, ?, ?, ?, ?)",
+                     (token, username, role, now, now))
+        conn.commit()
+        with self._lock:
+            self._sessions[token] = ((username, role), now)
+        return token
+
+    def get_session(self, token: str):
+        """
+        Получение сессии с отметкой об обращении (отметка записывается в базу вместе с остальными изменениями).
+
+        :return: кортеж (username, role) или None, если сессии нет или она истекла.
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._sessions.get(token)
+        # Давно не использованную в этом процессе сессию мог продлить другой процесс - проверяем по базе
+        if cached is not None and cached[1] >= now - self.session_ttl:
+            session = cached[0]
+        else:
+            cursor = self.shop.conn.cursor()
+            cursor.execute("SELECT username, role FROM sessions WHERE token=? AND last_seen >= ?",
+                           (token, now - self.session_ttl))
+            session = cursor.fetchone()
+            if session is None:
+                with self._lock:
+                    self._sessions.pop(token, None)
+                return None
+        with self._lock:
+            self._sessions[token] = (session, now)
+            self._touched[token] = now
+        self.maybe_flush()
+        return session
+
+    def end_session(self, token: str) -> None:
+        """
+        Завершение сессии; корзина покупателя сохраняется.
+        """
+        with self._lock:
+            session = self._sessions.pop(token, None)
+            self._touched.pop(token, None)
+        if session is not None:
+            self.flush_cart(session[0][0])
+        conn = self.shop.conn
+        conn.execute("DELETE FROM sessions WHERE token=?", (token,))
+        conn.commit()
+
+    def expire_sessions(self) -> int:
+        """
+        Удаление всех сессий, неактивных дольше session_ttl, одним запросом.
+
+        :return: число удалённых сессий.
+        """
+        self.flush()
+        cutoff = time.time() - self.session_ttl
+        conn = self.shop.conn
+        cursor = conn.execute("DELETE FROM sessions WHERE last_seen < ?", (cutoff,))
+        conn.commit()
+        with self._lock:
+            for token in [token for token, (_, last_seen) in self._sessions.items() if last_seen < cutoff]:
+                del self._sessions[token]
+        return cursor.rowcount
+
+    def expire_carts(self, max_age: float) -> int:
+        """
+        Удаление корзин, не менявшихся дольше max_age секунд.
+
+        :return: число удалённых корзин.
+        """
+        self.flush()
+        cutoff = time.time() - max_age
+        conn = self.shop.conn
+        conn.execute("DELETE FROM cart_items WHERE username IN (SELECT username FROM carts WHERE updated_at < ?)",
+                     (cutoff,))
+        cursor = conn.execute("DELETE FROM carts WHERE updated_at < ?", (cutoff,))
+        conn.commit()
+        with self._lock:
+            self._carts.clear()
+        return cursor.rowcount
+
+    # Корзины
+
+    def get_cart(self, username: str):
+        """
+        Корзина покупателя. Если в этом процессе есть незаписанные изменения или версия в базе
+        не менялась, корзина берётся из памяти без перечитывания строк.
+        """
+        with self._lock:
+            cached = self._carts.get(username)
+            if cached is not None and username in self._dirty:
+                return cached[1]
+        cursor = self.shop.conn.cursor()
+        cursor.execute("SELECT version FROM carts WHERE username=?", (username,))
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+        with self._lock:
+            cached = self._carts.get(username)
+            if cached is not None and (cached[0] == version or username in self._dirty):
+                return cached[1]
+
+        cart = self.cart_class(self.shop)
+        cursor.execute("SELECT product_name, product_id, price, quantity FROM cart_items WHERE username=?",
+                       (username,))
+        lines = {name: (product_id, price, quantity) for name, product_id, price, quantity in cursor.fetchall()}
+        _set_lines(cart, lines)
+        with self._lock:
+            self._carts[username] = [version, cart, lines]
+        return cart
+
+    def add_item(self, username: str, product_name: str, quantity: int) -> None:
+        self._change_cart(username, "add_item", product_name, quantity)
+
+    def update_item(self, username: str, product_name: str, quantity: int) -> None:
+        self._change_cart(username, "update_item", product_name, quantity)
+
+    def remove_item(self, username: str, product_name: str) -> None:
+        self._change_cart(username, "remove_item", product_name)
+
+    def clear_cart(self, username: str) -> None:
+        self._change_cart(username, "clear_cart")
+
+    def checkout(self, username: str):
+        """
+        Оформление заказа по сохранённой корзине; после заказа корзина очищается и сразу записывается.
+
+        :return: результат JewelryShop.create_order.
+        """
+        cart = self.get_cart(username)
+        with self._lock:
+            rehold = username in self._rehold
+            self._rehold.discard(username)
+        if rehold and self.reservations is not None:
+            # Нехватку проверит сам заказ
+            self.reservations.hold_cart(username, cart)
+        # Удержания покупателя возвращаются на склад в транзакции заказа и сразу списываются им же;
+        # транзакция заказа откатывается целиком, поэтому при занятой базе её можно повторить
+        result = retry_on_busy(self.shop.create_order, username, cart,
+                               holder=username if self.reservations is not None else None)
+        self._change_cart(username, "clear_cart")
+        self.flush_cart(username)
+        return result
+
+    def _change_cart(self, username: str, method: str, *args) -> None:
+        cart = self.get_cart(username)
+        with self._lock:
+            previous = [(name, line.product_id, line.price, line.quantity) for name, line in cart.items.items()]
+            getattr(cart, method)(*args)
+            self._dirty.add(username)
+        if self.reservations is not None and self.reservations.hold_cart(username, cart):
+            # Товара на складе не хватило: корзина возвращается в прежнее состояние
+            with self._lock:
+                cart.clear_cart()
+                for line in previous:
+                    cart.restore_line(*line)
+            raise ValueError("Недостаточно товара на складе.")
+        with self._lock:
+            self._rehold.discard(username)
+        self.maybe_flush()
+
+    # Запись накопленных изменений
+
+    def maybe_flush(self) -> None:
+        """
+        Запись изменений, если с прошлой записи прошло больше flush_interval секунд.
+        """
+        if time.monotonic() - self._last_flush >= self.flush_interval:
+            self._flush_and_expire()
+
+    def flush_cart(self, username: str) -> None:
+        self.flush((username,))
+
+    def flush(self, usernames=None) -> None:
+        """
+        Запись изменённых корзин и отметок активности сессий одной транзакцией.
+        Корзина записывается, только если её версия в базе не изменилась с момента чтения;
+        иначе изменения этого процесса сливаются со строками, записанными другим процессом.
+
+        :param usernames: чьи корзины записать; None - все изменённые.
+        """
+        with self._lock:
+            # Копия: при ошибке записи эти покупатели возвращаются в self._dirty
+            dirty = set(self._dirty) if usernames is None else self._dirty.intersection(usernames)
+            # username -> (ожидаемая версия, строки корзины сейчас, строки в ожидаемой версии)
+            pending = {username: (self._carts[username][0], _cart_lines(self._carts[username][1]),
+                                  self._carts[username][2]) for username in dirty}
+            touched, self._touched = self._touched, {}
+            self._dirty -= dirty
+            self._last_flush = time.monotonic()
+        if not pending and not touched:
+            return
+
+        now = time.time()
+        conn = self.shop.conn
+        written = {}  # username -> (новая версия, записанные строки)
+        merged = []
+        try:
+            cursor = begin_immediate(conn)
+            cursor.executemany("UPDATE sessions SET last_seen = ? WHERE token = ?",
+                               [(last_seen, token) for token, last_seen in touched.items()])
+            for username, (expected, lines, base) in pending.items():
+                cursor.execute("UPDATE carts SET version = version + 1, updated_at = ? "
+                               "WHERE username = ? AND version = ?", (now, username, expected))
+                if cursor.rowcount == 0 and expected == 0:
+                    cursor.execute("INSERT INTO carts (username, version, updated_at) VALUES (?, 1, ?) "
+                                   "ON CONFLICT(username) DO NOTHING", (username, now))
+                if cursor.rowcount == 0:
+                    # Корзину уже записал другой процесс: накладываем свои изменения на его строки
+                    cursor.execute("SELECT product_name, product_id, price, quantity FROM cart_items WHERE username=?",
+                                   (username,))
+                    stored = {name: (product_id, price, quantity)
+                              for name, product_id, price, quantity in cursor.fetchall()}
+                    lines = _merge_lines(base, lines, stored)
+                    merged.append(username)
+                    # Строки carts может уже не быть (её удалил expire_carts), поэтому вставляем заново;
+                    # новая версия больше ожидаемой, чтобы чужой кэш старой корзины не счёлся актуальным
+                    cursor.execute("INSERT INTO carts (username, version, updated_at) VALUES (?, ?, ?) "
+                                   "ON CONFLICT(username) DO UPDATE SET version = version + 1, "
+                                   "updated_at = excluded.updated_at",
+                                   (username, expected + 1, now))
+                cursor.execute("DELETE FROM cart_items WHERE username=?", (username,))
+                cursor.executemany("INSERT INTO cart_items (username, product_name, product_id, price, quantity) "
+                                   "VALUES (?, ?, ?, ?, ?)",
+                                   [(username, name, product_id, price, quantity)
+                                    for name, (product_id, price, quantity) in lines.items()])
+                cursor.execute("SELECT version FROM carts WHERE username=?", (username,))
+                written[username] = (cursor.fetchone()[0], lines)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with self._lock:
+                self._dirty |= dirty
+                for token, last_seen in touched.items():
+                    self._touched.setdefault(token, last_seen)
+            raise
+        with self._lock:
+            for username, (version, lines) in written.items():
+                entry = self._carts.get(username)
+                if entry is None:
+                    continue
+                # Изменения, сделанные в памяти во время записи, сохраняются поверх записанных строк
+                _set_lines(entry[1], _merge_lines(pending[username][1], _cart_lines(entry[1]), lines))
+                entry[0], entry[2] = version, lines
+            # Запись может идти без сессии покупателя (фоновый поток, close), поэтому вся слитая корзина
+            # удерживается при следующем действии покупателя с ней
+            self._rehold.update(merged)
+
+    def _flush_and_expire(self) -> None:
+        # expire_sessions сначала записывает накопленные изменения
+        self.expire_sessions()
+        if self.reservations is not None:
+            self.reservations.expire()
+
+    def _flush_loop(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self._flush_and_expire()
+            except Exception as e:
+                print(e)
+
+    def close(self) -> None:
+        """
+        Остановка фонового потока и запись всех изменений.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
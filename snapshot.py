@@ -0,0 +1,344 @@
+"""
+Выгрузка, резервное копирование и восстановление баз магазина и пользователей.
+
+export_snapshot потоково (порциями по EXPORT_BATCH_SIZE строк) выгружает таблицы в JSONL или CSV,
+по умолчанию сжатые gzip, и пишет manifest.json со схемой (из sqlite_master), версией схемы,
+счётчиками AUTOINCREMENT (sqlite_sequence) и числом строк. Каждая база выгружается в одной
+читающей транзакции, поэтому снимок согласован; в режиме WAL оформление заказов при этом
+не останавливается.
+
+restore_snapshot загружает снимок в новые базы: сначала создаются только таблицы, строки
+вставляются пакетами без индексов и триггеров, затем создаются индексы и триггеры и
+перестраивается полнотекстовый индекс.
+
+backup_database - копия файла базы через online backup API SQLite.
+
+Примеры:
+    python snapshot.py export backup-dir
+    python snapshot.py export backup-dir --format csv --no-compress
+    python snapshot.py backup backup-dir
+    python snapshot.py restore backup-dir --target restored-dir
+    python snapshot.py check    (выгрузка и восстановление временной базы с проверкой результата)
+"""
+import csv
+import gzip
+import itertools
+import json
+import os
+import sqlite3
+import time
+
+from database import connect
+
+DEFAULT_DATABASES = {"shop": "jewelry_shop.db", "users": "users.db"}
+EXPORT_BATCH_SIZE = 1000
+MANIFEST_NAME = "manifest.json"
+# NULL в CSV (пустая строка - обычное значение, например description)
+CSV_NULL = "\\N"
+
+
+def _open_text(path: str, mode: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", newline="")
+    return open(path, mode, encoding="utf-8", newline="")
+
+
+def _schema(conn: sqlite3.Connection) -> list:
+    """
+    Схема базы из sqlite_master без служебных таблиц SQLite и теневых таблиц FTS5.
+    return: список [type, name, tbl_name, sql] в порядке создания.
+    """
+    rows = conn.execute("SELECT type, name, tbl_name, sql FROM sqlite_master "
+                        "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid").fetchall()
+    virtual = [name for kind, name, _, sql in rows if kind == "table" and sql.upper().startswith("CREATE VIRTUAL")]
+    # Теневые таблицы (products_fts_data и т.п.) создаёт сама виртуальная таблица; триггеры с тем же
+    # префиксом (products_fts_insert и т.п.) - часть схемы и восстанавливаются
+    return [list(row) for row in rows
+            if row[0] != "table" or not any(row[1].startswith(name + "_") for name in virtual)]
+
+
+def _sequences(conn: sqlite3.Connection) -> dict:
+    """
+    Счётчики AUTOINCREMENT: без них после восстановления снова выдавались бы id удалённых строк.
+    return: {таблица: последний выданный id}.
+    """
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_sequence'").fetchone() is None:
+        return {}
+    return dict(conn.execute("SELECT name, seq FROM sqlite_sequence").fetchall())
+
+
+def _data_tables(schema: list) -> list:
+    return [name for kind, name, _, sql in schema if kind == "table" and not sql.upper().startswith("CREATE VIRTUAL")]
+
+
+def export_table(cursor: sqlite3.Cursor, table: str, path: str, file_format: str = "jsonl",
+                 batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Потоковая выгрузка таблицы в файл; в памяти одновременно не больше batch_size строк.
+    Сжатие gzip - если path оканчивается на ".gz".
+
+    :param file_format: "jsonl" (объект на строку) или "csv" (с заголовком, NULL записывается как \\N).
+    :return: {"columns": [...], "rows": число строк}.
+    """
+    cursor.execute(f'SELECT * FROM "{table}" ORDER BY rowid' if _has_rowid(cursor, table) else f'SELECT * FROM "{table}"')
+    columns = [description[0] for description in cursor.description]
+    count = 0
+    with _open_text(path, "w") as file:
+        if file_format == "csv":
+            writer = csv.writer(file)
+            writer.writerow(columns)
+        elif file_format != "jsonl":
+            raise ValueError(f"Неизвестный формат выгрузки: {file_format!r}.")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            if file_format == "csv":
+                writer.writerows([CSV_NULL if value is None else value for value in row] for row in rows)
+            else:
+                file.writelines(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+            count += len(rows)
+    return {"columns": columns, "rows": count}
+
+
+def _has_rowid(cursor: sqlite3.Cursor, table: str) -> bool:
+    sql = cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone()[0]
+    return "WITHOUT ROWID" not in sql.upper()
+
+
+def export_snapshot(directory: str, databases: dict = None, file_format: str = "jsonl", compress: bool = True,
+                    batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Выгрузка всех таблиц баз в каталог directory.
+
+    :param databases: {имя базы в снимке: путь к файлу}; по умолчанию DEFAULT_DATABASES.
+    :return: манифест снимка (он же записывается в manifest.json).
+    """
+    databases = DEFAULT_DATABASES if databases is None else databases
+    os.makedirs(directory, exist_ok=True)
+    extension = "." + file_format + (".gz" if compress else "")
+    manifest = {"format": file_format, "created_at": time.time(), "databases": {}}
+    for name, database_path in databases.items():
+        conn = connect(database_path)
+        try:
+            # Одна читающая транзакция на базу: все таблицы выгружаются из одного согласованного состояния
+            conn.execute("BEGIN")
+            schema = _schema(conn)
+            entry = {"user_version": conn.execute("PRAGMA user_version").fetchone()[0],
+                     "schema": schema, "sequences": _sequences(conn), "tables": {}}
+            cursor = conn.cursor()
+            for table in _data_tables(schema):
+                file_name = f"{name}.{table}{extension}"
+                entry["tables"][table] = dict(export_table(cursor, table, os.path.join(directory, file_name),
+                                                           file_format, batch_size), file=file_name)
+            conn.rollback()
+        finally:
+            conn.close()
+        manifest["databases"][name] = entry
+
+    with open(os.path.join(directory, MANIFEST_NAME), "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False, indent=2)
+    return manifest
+
+
+def _read_rows(path: str, file_format: str, columns: list):
+    with _open_text(path, "r") as file:
+        if file_format == "csv":
+            reader = csv.reader(file)
+            next(reader)
+            for row in reader:
+                yield [None if value == CSV_NULL else value for value in row]
+        else:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield [record[column] for column in columns]
+
+
+def restore_snapshot(directory: str, targets: dict = None, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """
+    Восстановление снимка в новые (несуществующие или пустые) базы.
+    Индексы и триггеры создаются после загрузки всех строк.
+
+    :param targets: {имя базы в снимке: путь к новому файлу}; по умолчанию DEFAULT_DATABASES.
+    :return: {имя базы: {таблица: число загруженных строк}}.
+    """
+    with open(os.path.join(directory, MANIFEST_NAME), encoding="utf-8") as file:
+        manifest = json.load(file)
+    targets = DEFAULT_DATABASES if targets is None else targets
+    file_format = manifest["format"]
+    summary = {}
+    for name, target_path in targets.items():
+        entry = manifest["databases"][name]
+        conn = sqlite3.connect(target_path)
+        try:
+            if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0]:
+                raise FileExistsError(f"База {target_path} не пуста; восстановление выполняется только в новую базу.")
+            # Файл новый: при сбое загрузку проще повторить, поэтому журнал и fsync на время загрузки выключены
+            conn.execute("PRAGMA journal_mode=OFF")
+            conn.execute("PRAGMA synchronous=OFF")
+            deferred = []
+            conn.execute("BEGIN")
+            for kind, object_name, _, sql in entry["schema"]:
+                if kind == "table":
+                    conn.execute(sql)
+                else:
+                    deferred.append(sql)
+
+            loaded = {}
+            for table, info in entry["tables"].items():
+                columns = info["columns"]
+                insert = (f'INSERT INTO "{table}" ({", ".join(columns)}) '
+                          f'VALUES ({", ".join("?" * len(columns))})')
+                rows = _read_rows(os.path.join(directory, info["file"]), file_format, columns)
+                loaded[table] = 0
+                while True:
+                    chunk = list(itertools.islice(rows, batch_size))
+                    if not chunk:
+                        break
+                    conn.executemany(insert, chunk)
+                    loaded[table] += len(chunk)
+                if loaded[table] != info["rows"]:
+                    raise ValueError(f"{info['file']}: загружено {loaded[table]} строк, в манифесте {info['rows']}.")
+
+            # Индексы строятся один раз по загруженным данным, триггеры не срабатывали на каждую строку
+            for sql in deferred:
+                conn.execute(sql)
+            for kind, object_name, _, sql in entry["schema"]:
+                if kind == "table" and sql.upper().startswith("CREATE VIRTUAL") and "CONTENT=" in sql.upper():
+                    conn.execute(f"INSERT INTO \"{object_name}\" (\"{object_name}\") VALUES ('rebuild')")
+            # Вставка строк с явными id сдвигает счётчик только до наибольшего загруженного id
+            for table, seq in entry.get("sequences", {}).items():
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table,))
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table, seq))
+            conn.execute(f"PRAGMA user_version = {int(entry['user_version'])}")
+            conn.commit()
+            conn.execute("PRAGMA journal_mode=WAL")
+        finally:
+            conn.close()
+        summary[name] = loaded
+    return summary
+
+
+def backup_database(database_path: str, destination_path: str, pages: int = -1, progress=None) -> None:
+    """
+    Резервная копия через online backup API SQLite.
+    При pages=-1 копия снимается за один шаг в одной читающей транзакции: в режиме WAL это не
+    блокирует запись, а копия соответствует одному моменту времени. При pages > 0 копирование идёт
+    шагами, но изменения базы другими соединениями заставляют начинать копирование заново.
+
+    :param progress: функция progress(status, remaining, total), вызываемая после каждого шага.
+    """
+    source = connect(database_path)
+    destination = sqlite3.connect(destination_path)
+    try:
+        source.backup(destination, pages=pages, progress=progress)
+    finally:
+        destination.close()
+        source.close()
+
+
+def backup_databases(directory: str, databases: dict = None) -> dict:
+    """
+    Резервные копии всех баз в каталог directory.
+    return: {имя базы: путь к копии}.
+    """
+    databases = DEFAULT_DATABASES if databases is None else databases
+    os.makedirs(directory, exist_ok=True)
+    copies = {}
+    for name, database_path in databases.items():
+        copies[name] = os.path.join(directory, os.path.basename(database_path))
+        backup_database(database_path, copies[name])
+    return copies
+
+
+def round_trip_check(file_format: str = "jsonl") -> dict:
+    """
+    Проверка выгрузки и восстановления на временной базе магазина: схема восстановленной базы
+    совпадает с исходной (таблицы, индексы, триггеры), а полнотекстовый поиск находит и
+    восстановленные товары, и товар, добавленный уже после восстановления.
+
+    :return: сводка проверки.
+    :raises AssertionError: если восстановленная база отличается от исходной.
+    """
+    import contextlib
+    import io
+    import tempfile
+
+    from Python4 import JewelryShop
+
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+        source_path = os.path.join(directory, "source.db")
+        source = JewelryShop(source_path)
+        source.add_product("Gold Ring", 100.0, 5, description="classic band")
+        source.add_product("Silver Chain", 50.0, 3)
+        source.create_order("customer", {"Gold Ring": 1})
+        source.delete_order(1)
+        source.pool.close_all()
+
+        export_snapshot(os.path.join(directory, "snapshot"), {"shop": source_path}, file_format)
+        restored_path = os.path.join(directory, "restored.db")
+        restore_snapshot(os.path.join(directory, "snapshot"), {"shop": restored_path})
+
+        schemas = []
+        for path in (source_path, restored_path):
+            conn = sqlite3.connect(path)
+            schemas.append(sorted((kind, name) for kind, name, _, _ in _schema(conn)))
+            conn.close()
+        restored = JewelryShop(restored_path)
+        restored.add_product("New Pendant", 75.0, 2)
+        result = {
+            "format": file_format,
+            "objects": len(schemas[1]),
+            "triggers": sum(kind == "trigger" for kind, _ in schemas[1]),
+            "found_restored": [product[1] for product in restored.search_products("ring")],
+            "found_added": [product[1] for product in restored.search_products("pendant")],
+            "next_order_id": restored.create_order("customer", {"Silver Chain": 1})[0],
+        }
+        restored.pool.close_all()
+
+    assert schemas[0] == schemas[1], (schemas[0], schemas[1])
+    assert result["found_restored"] == ["Gold Ring"], result
+    assert result["found_added"] == ["New Pendant"], result
+    assert result["next_order_id"] == 2, result
+    return result
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export, back up and restore the shop databases.")
+    parser.add_argument("--shop", default=DEFAULT_DATABASES["shop"], help="shop database path")
+    parser.add_argument("--users", default=DEFAULT_DATABASES["users"], help="users database path")
+    commands = parser.add_subparsers(dest="command", required=True)
+    export_parser = commands.add_parser("export", help="stream all tables to JSONL/CSV files")
+    export_parser.add_argument("directory")
+    export_parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl")
+    export_parser.add_argument("--no-compress", action="store_true")
+    backup_parser = commands.add_parser("backup", help="online backup of the database files")
+    backup_parser.add_argument("directory")
+    restore_parser = commands.add_parser("restore", help="load an export into new databases")
+    restore_parser.add_argument("directory")
+    restore_parser.add_argument("--target", default=".", help="directory for the restored databases")
+    commands.add_parser("check", help="export and restore a temporary shop and verify the result")
+    args = parser.parse_args(argv)
+
+    databases = {"shop": args.shop, "users": args.users}
+    if args.command == "export":
+        manifest = export_snapshot(args.directory, databases, args.format, not args.no_compress)
+        result = {name: {table: info["rows"] for table, info in entry["tables"].items()}
+                  for name, entry in manifest["databases"].items()}
+    elif args.command == "backup":
+        result = backup_databases(args.directory, databases)
+    elif args.command == "check":
+        result = [round_trip_check(file_format) for file_format in ("jsonl", "csv")]
+    else:
+        os.makedirs(args.target, exist_ok=True)
+        result = restore_snapshot(args.directory, {name: os.path.join(args.target, os.path.basename(path))
+                                                   for name, path in databases.items()})
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())